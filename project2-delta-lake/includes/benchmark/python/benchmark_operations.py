@@ -0,0 +1,612 @@
+# Databricks notebook source
+# MAGIC 
+# MAGIC %md
+# MAGIC # Benchmarks for Operations
+# MAGIC 
+# MAGIC Run locally from `includes/` with
+# MAGIC `python -m benchmark.python.benchmark_operations`.
+# MAGIC
+# MAGIC Every measurement records wall time, rows/sec, shuffle bytes written and
+# MAGIC Delta files written. With `--results` the runs are appended to a JSON-lines
+# MAGIC file under a `--label` (e.g. a git revision) and compared with the latest
+# MAGIC run of any other label, so regressions show up between versions.
+
+# COMMAND ----------
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.request import urlopen
+
+from delta import configure_spark_with_delta_pip
+from delta.tables import DeltaTable
+from pyspark import sql
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql.functions import col, lag, lead
+from pyspark.sql.window import Window
+
+# COMMAND ----------
+
+from benchmark.python.data_generator import generate_raw_data
+from main.python.operations import (
+    BRONZE_PAYLOAD_COMPRESSION,
+    SILVER_LAYOUTS,
+    apply_silver_layout,
+    create_medallion_stream_writer,
+    create_stream_writer,
+    read_stream_delta,
+    read_device_range,
+    read_stream_raw,
+    read_silver,
+    transform_bronze,
+    transform_raw,
+    transform_silver_mean_agg,
+    update_file_index,
+    update_silver_table,
+)
+
+# COMMAND ----------
+
+def synthetic_bronze(
+    spark: SparkSession, rows: int, devices: int = 1000, broken_rate: float = 0.0
+) -> DataFrame:
+    """Bronze `value` lines in the health-tracker JSON format, hourly per device."""
+    return spark.range(rows).selectExpr(
+        f"""
+        to_json(named_struct(
+            'device_id', cast(id % {devices} AS INT),
+            'heartrate', (CASE WHEN rand(7) < {broken_rate} THEN -1 ELSE 1 END)
+                         * (60 + 10 * randn(42)),
+            'name', concat('Device ', cast(id % {devices} AS STRING)),
+            'time', cast(1577836800 + (id DIV {devices}) * 3600 AS DOUBLE)
+        )) AS value
+        """
+    )
+
+
+# COMMAND ----------
+
+def time_noop_write(dataframe: DataFrame) -> float:
+    start = time.perf_counter()
+    dataframe.write.format("noop").mode("overwrite").save()
+    return time.perf_counter() - start
+
+
+# COMMAND ----------
+
+def measure(
+    spark: SparkSession,
+    suite: str,
+    operation: str,
+    rows: int,
+    run,
+    delta_paths: list = (),
+) -> dict:
+    """Run `run()` once and record its cost.
+
+    Shuffle bytes are the growth of the application-wide shuffle write total
+    from the Spark UI REST API, so streaming jobs on other threads count too;
+    files written are the files added by new commits to `delta_paths`.
+    """
+    versions = {path: _delta_version(spark, path) for path in delta_paths}
+    shuffle_before = _shuffle_write_bytes(spark)
+
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+
+    shuffle_after = _shuffle_write_bytes(spark)
+    return {
+        "suite": suite,
+        "operation": operation,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds,
+        "shuffle_bytes": (
+            None
+            if shuffle_before is None or shuffle_after is None
+            else shuffle_after - shuffle_before
+        ),
+        "files_written": sum(
+            _delta_files_added(spark, path, version)
+            for path, version in versions.items()
+        ),
+    }
+
+
+def fastest(records: list) -> dict:
+    return min(records, key=lambda record: record["seconds"])
+
+
+def _shuffle_write_bytes(spark: SparkSession) -> int:
+    context = spark.sparkContext
+    if not context.uiWebUrl:
+        return None
+    # stage metrics reach the UI store through the async listener bus
+    time.sleep(0.5)
+    url = f"{context.uiWebUrl}/api/v1/applications/{context.applicationId}/stages"
+    with urlopen(url) as response:
+        stages = json.load(response)
+    return sum(stage.get("shuffleWriteBytes", 0) for stage in stages)
+
+
+def _delta_version(spark: SparkSession, path: str) -> int:
+    if not DeltaTable.isDeltaTable(spark, path):
+        return -1
+    return DeltaTable.forPath(spark, path).history(1).first()["version"]
+
+
+def _delta_files_added(spark: SparkSession, path: str, since_version: int) -> int:
+    if not DeltaTable.isDeltaTable(spark, path):
+        return 0
+    commits = (
+        DeltaTable.forPath(spark, path)
+        .history()
+        .where(col("version") > since_version)
+        .select("operationMetrics")
+        .collect()
+    )
+    added = 0
+    for (metrics,) in commits:
+        metrics = metrics or {}
+        for key in ("numFiles", "numTargetFilesAdded", "numAddedFiles"):
+            added += int(metrics.get(key, 0))
+    return added
+
+
+# COMMAND ----------
+
+def benchmark_transform_bronze(
+    spark: SparkSession, rows: int, engines: list = None, repeats: int = 3
+) -> list:
+    bronze = synthetic_bronze(spark, rows).cache()
+    bronze.count()
+
+    results = []
+    for engine in engines or ["from_json", "arrow"]:
+        parsed = transform_bronze(bronze, engine=engine)
+        records = [
+            measure(spark, "parse", engine, rows, lambda: time_noop_write(parsed))
+            for _ in range(repeats)
+        ]
+        results.append(fastest(records))
+
+    bronze.unpersist()
+    return results
+
+
+# COMMAND ----------
+
+def write_synthetic_silver(
+    spark: SparkSession,
+    silverPath: str,
+    rows: int,
+    broken_rate: float = 0.001,
+    layout: str = "date",
+) -> None:
+    silverDF = transform_bronze(synthetic_bronze(spark, rows, broken_rate=broken_rate))
+    (
+        apply_silver_layout(silverDF, layout)
+        .write.format("delta")
+        .mode("overwrite")
+        .option("overwriteSchema", True)
+        .partitionBy(*SILVER_LAYOUTS[layout])
+        .save(silverPath)
+    )
+
+
+# COMMAND ----------
+
+def update_silver_table_full_window(spark: SparkSession, silverPath: str) -> bool:
+    """The original single-partition interpolation, kept as the benchmark baseline."""
+    dateWindow = Window.orderBy("p_eventdate")
+
+    interpolatedDF = spark.read.format("delta").load(silverPath).select(
+        "*",
+        lag(col("heartrate")).over(dateWindow).alias("prev_amt"),
+        lead(col("heartrate")).over(dateWindow).alias("next_amt"),
+    )
+
+    updatesDF = interpolatedDF.where(col("heartrate") < 0).select(
+        "device_id",
+        ((col("prev_amt") + col("next_amt")) / 2).alias("heartrate"),
+        "eventtime",
+        "name",
+        "p_eventdate",
+    )
+
+    (
+        DeltaTable.forPath(spark, silverPath)
+        .alias("health_tracker")
+        .merge(
+            updatesDF.alias("updates"),
+            """
+            health_tracker.eventtime = updates.eventtime
+            AND
+            health_tracker.device_id = updates.device_id
+            """,
+        )
+        .whenMatchedUpdate(set={"heartrate": "updates.heartrate"})
+        .execute()
+    )
+    return True
+
+
+# COMMAND ----------
+
+def benchmark_update_silver_table(
+    spark: SparkSession, workdir: str, sizes: list, repeats: int = 1
+) -> list:
+    silverPath = os.path.join(workdir, "silver")
+    implementations = {
+        "full_window": update_silver_table_full_window,
+        "partitioned": update_silver_table,
+    }
+
+    results = []
+    for rows in sizes:
+        for engine, implementation in implementations.items():
+            records = []
+            for _ in range(repeats):
+                write_synthetic_silver(spark, silverPath, rows)
+                records.append(
+                    measure(
+                        spark,
+                        "interpolation",
+                        engine,
+                        rows,
+                        lambda: implementation(spark, silverPath),
+                        [silverPath],
+                    )
+                )
+            results.append(fastest(records))
+    return results
+
+
+# COMMAND ----------
+
+def benchmark_bronze_formats(
+    spark: SparkSession, workdir: str, sizes: list, repeats: int = 1
+) -> list:
+    """Write bronze raw-only and parsed, then rebuild silver from each."""
+    formats = {"raw": (False, None), "parsed": (True, BRONZE_PAYLOAD_COMPRESSION)}
+
+    results = []
+    for rows in sizes:
+        rawDF = synthetic_bronze(spark, rows, broken_rate=0.001).cache()
+        rawDF.count()
+        for bronze_format, (parsed, compression) in formats.items():
+            bronzePath = os.path.join(workdir, f"bronze_{bronze_format}")
+
+            def write_bronze() -> None:
+                writer = (
+                    transform_raw(rawDF, parsed=parsed)
+                    .write.format("delta")
+                    .mode("overwrite")
+                    .partitionBy("p_ingestdate")
+                )
+                if compression is not None:
+                    writer = writer.option("compression", compression)
+                writer.save(bronzePath)
+
+            def rebuild_silver() -> None:
+                time_noop_write(
+                    transform_bronze(spark.read.format("delta").load(bronzePath))
+                )
+
+            for operation, run, paths in [
+                ("write_bronze", write_bronze, [bronzePath]),
+                ("rebuild_silver", rebuild_silver, []),
+            ]:
+                operation = f"{operation}[{bronze_format}]"
+                records = [
+                    measure(spark, "bronze", operation, rows, run, paths)
+                    for _ in range(repeats)
+                ]
+                results.append(fastest(records))
+                results[-1]["bronze_bytes"] = _directory_bytes(bronzePath)
+        rawDF.unpersist()
+    return results
+
+
+def _directory_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(directory, file))
+        for directory, _, files in os.walk(path)
+        for file in files
+        if file.endswith(".parquet")
+    )
+
+
+# COMMAND ----------
+
+def benchmark_silver_layouts(
+    spark: SparkSession, workdir: str, sizes: list, repeats: int = 1
+) -> list:
+    """Per-device reads, aggregations and MERGEs on the same data in each layout."""
+    probeDF = spark.createDataFrame([(7,)], "device_id INT")
+    probe_start = datetime(2020, 1, 1)
+    probe_end = probe_start + timedelta(days=2)
+    touchedDF = spark.range(0, 1000, 100).selectExpr("cast(id AS INT) AS device_id")
+
+    def noop(dataframe: DataFrame):
+        return lambda: dataframe.write.format("noop").mode("overwrite").save()
+
+    results = []
+    for rows in sizes:
+        for layout in SILVER_LAYOUTS:
+            silverPath = os.path.join(workdir, f"silver_{layout}")
+            records = {}
+            for _ in range(repeats):
+                write_synthetic_silver(spark, silverPath, rows, layout=layout)
+                steps = [
+                    ("build_file_index", lambda: update_file_index(spark, silverPath)),
+                    ("device_lookup", noop(read_silver(spark, silverPath, probeDF))),
+                    (
+                        "indexed_device_range",
+                        lambda: time_noop_write(
+                            read_device_range(
+                                spark, silverPath, 7, probe_start, probe_end
+                            )
+                        ),
+                    ),
+                    (
+                        "touched_devices_agg",
+                        noop(
+                            transform_silver_mean_agg(
+                                read_silver(spark, silverPath, touchedDF)
+                            )
+                        ),
+                    ),
+                    (
+                        "full_mean_agg",
+                        noop(transform_silver_mean_agg(read_silver(spark, silverPath))),
+                    ),
+                    (
+                        "update_silver_table",
+                        lambda: update_silver_table(spark, silverPath),
+                    ),
+                ]
+                for operation, run in steps:
+                    records.setdefault(operation, []).append(
+                        measure(
+                            spark,
+                            "layout",
+                            f"{operation}[{layout}]",
+                            rows,
+                            run,
+                            [silverPath],
+                        )
+                    )
+            results += [fastest(timings) for timings in records.values()]
+    return results
+
+
+# COMMAND ----------
+
+def benchmark_pipeline(
+    spark: SparkSession, workdir: str, devices: list, months: int = 1
+) -> list:
+    """Each operation, each stream writer and the whole raw -> gold pipeline.
+
+    Raw files come from the synthetic generator at each device count; the
+    batch steps chain raw -> bronze -> silver -> gold, and the streaming steps
+    replay the same files with an availableNow trigger into fresh tables.
+    """
+    results = []
+    for device_count in devices:
+        root = os.path.join(workdir, f"devices_{device_count}")
+        shutil.rmtree(root, ignore_errors=True)
+        rawPath = os.path.join(root, "raw")
+        written = generate_raw_data(
+            rawPath, [(2020, month) for month in range(1, months + 1)], device_count
+        )
+        rows = sum(written.values())
+        results += _benchmark_batch_operations(spark, root, rawPath, rows)
+        results += _benchmark_stream_writers(spark, root, rawPath, rows)
+    return results
+
+
+def _benchmark_batch_operations(
+    spark: SparkSession, root: str, rawPath: str, rows: int
+) -> list:
+    bronzePath, silverPath, goldPath = (
+        os.path.join(root, "batch", layer) for layer in ("bronze", "silver", "gold")
+    )
+
+    def raw_to_bronze() -> None:
+        (
+            transform_raw(spark.read.text(rawPath))
+            .write.format("delta")
+            .partitionBy("p_ingestdate")
+            .save(bronzePath)
+        )
+
+    def bronze_to_silver() -> None:
+        (
+            transform_bronze(spark.read.format("delta").load(bronzePath))
+            .write.format("delta")
+            .partitionBy("p_eventdate")
+            .save(silverPath)
+        )
+
+    def silver_to_gold() -> None:
+        (
+            transform_silver_mean_agg(spark.read.format("delta").load(silverPath))
+            .write.format("delta")
+            .mode("overwrite")
+            .save(goldPath)
+        )
+
+    steps = [
+        ("transform_raw", raw_to_bronze, [bronzePath]),
+        ("transform_bronze", bronze_to_silver, [silverPath]),
+        (
+            "update_silver_table",
+            lambda: update_silver_table(spark, silverPath),
+            [silverPath],
+        ),
+        ("transform_silver_mean_agg", silver_to_gold, [goldPath]),
+    ]
+    return [
+        measure(spark, "pipeline", operation, rows, run, paths)
+        for operation, run, paths in steps
+    ]
+
+
+def _benchmark_stream_writers(
+    spark: SparkSession, root: str, rawPath: str, rows: int
+) -> list:
+    streamRoot = os.path.join(root, "stream")
+    bronzePath, silverPath, goldPath = (
+        os.path.join(streamRoot, layer) for layer in ("bronze", "silver", "gold")
+    )
+    checkpoint = os.path.join(streamRoot, "_checkpoints")
+    availableNow = {"availableNow": True}
+
+    def raw_to_bronze() -> None:
+        create_stream_writer(
+            transform_raw(read_stream_raw(spark, rawPath, profile="backfill")),
+            os.path.join(checkpoint, "bronze"),
+            "benchmark_raw_to_bronze",
+            "p_ingestdate",
+            trigger=availableNow,
+        ).start(bronzePath).awaitTermination()
+
+    def bronze_to_silver() -> None:
+        create_stream_writer(
+            transform_bronze(read_stream_delta(spark, bronzePath, profile="backfill")),
+            os.path.join(checkpoint, "silver"),
+            "benchmark_bronze_to_silver",
+            "p_eventdate",
+            trigger=availableNow,
+        ).start(silverPath).awaitTermination()
+
+    medallionRoot = os.path.join(root, "medallion")
+    medallionPaths = [
+        os.path.join(medallionRoot, layer) for layer in ("bronze", "silver", "gold")
+    ]
+
+    def raw_to_gold() -> None:
+        create_medallion_stream_writer(
+            read_stream_raw(spark, rawPath, profile="backfill"),
+            os.path.join(medallionRoot, "_checkpoint"),
+            "benchmark_medallion",
+            *medallionPaths,
+            trigger=availableNow,
+        ).start().awaitTermination()
+
+    steps = [
+        ("stream_raw_to_bronze", raw_to_bronze, [bronzePath]),
+        ("stream_bronze_to_silver", bronze_to_silver, [silverPath]),
+        ("medallion_raw_to_gold", raw_to_gold, medallionPaths),
+    ]
+    return [
+        measure(spark, "pipeline", operation, rows, run, paths)
+        for operation, run, paths in steps
+    ]
+
+
+# COMMAND ----------
+
+def print_results(results: list, baseline: dict = None) -> None:
+    line = (
+        "{operation:>26} {rows:>12,} rows {seconds:>8.2f} s"
+        " {rows_per_sec:>14,.0f} rows/s {shuffle:>14} shuffle {files_written:>6} files"
+    )
+    for result in results:
+        shuffle = result["shuffle_bytes"]
+        shuffle = "n/a" if shuffle is None else f"{shuffle:,}"
+        text = line.format(**result, shuffle=shuffle)
+        previous = (baseline or {}).get(_result_key(result))
+        if "bronze_bytes" in result:
+            text += f" {result['bronze_bytes']:>14,} bytes on disk"
+        if previous is not None:
+            change = result["seconds"] / previous["seconds"] - 1
+            text += f" {change:+7.1%} vs {previous['label']}"
+        print(text)
+
+
+# COMMAND ----------
+
+def store_results(results: list, path: str, label: str) -> None:
+    """Append the results as JSON lines tagged with label and a UTC timestamp."""
+    recorded_at = datetime.now(timezone.utc).isoformat()
+    with open(path, "a") as out:
+        for result in results:
+            record = {"label": label, "recorded_at": recorded_at, **result}
+            out.write(json.dumps(record) + "\n")
+
+
+def load_baseline(path: str, label: str) -> dict:
+    """Latest stored result per (suite, operation, rows) from any other label."""
+    baseline = {}
+    if not os.path.exists(path):
+        return baseline
+    with open(path) as stored:
+        for line in stored:
+            record = json.loads(line)
+            if record["label"] != label:
+                baseline[_result_key(record)] = record
+    return baseline
+
+
+def _result_key(result: dict) -> tuple:
+    return result["suite"], result["operation"], result["rows"]
+
+
+# COMMAND ----------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark operations.")
+    parser.add_argument(
+        "--suite",
+        choices=["parse", "interpolation", "bronze", "layout", "pipeline"],
+        default="parse",
+    )
+    parser.add_argument("--rows", type=int, nargs="+", default=[5_000_000])
+    parser.add_argument("--devices", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--months", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--results", default=None)
+    parser.add_argument("--label", default="current")
+    args = parser.parse_args()
+
+    builder = (
+        sql.SparkSession.builder.master(args.master)
+        .config("spark.sql.extensions", "io.delta.sql.DeltaSparkSessionExtension")
+        .config(
+            "spark.sql.catalog.spark_catalog",
+            "org.apache.spark.sql.delta.catalog.DeltaCatalog",
+        )
+        .config("spark.ui.retainedStages", 100_000)
+        .config("spark.ui.retainedJobs", 100_000)
+    )
+    spark = configure_spark_with_delta_pip(builder).getOrCreate()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="health_tracker_benchmark_")
+    if args.suite == "parse":
+        results = []
+        for rows in args.rows:
+            results += benchmark_transform_bronze(spark, rows, repeats=args.repeats)
+    elif args.suite == "interpolation":
+        results = benchmark_update_silver_table(
+            spark, workdir, args.rows, args.repeats
+        )
+    elif args.suite == "bronze":
+        results = benchmark_bronze_formats(spark, workdir, args.rows, args.repeats)
+    elif args.suite == "layout":
+        results = benchmark_silver_layouts(spark, workdir, args.rows, args.repeats)
+    else:
+        results = benchmark_pipeline(spark, workdir, args.devices, args.months)
+
+    baseline = load_baseline(args.results, args.label) if args.results else None
+    print_results(results, baseline)
+    if args.results:
+        store_results(results, args.results, args.label)
@@ -0,0 +1,251 @@
+# Databricks notebook source
+# MAGIC
+# MAGIC %md
+# MAGIC # Synthetic Health Tracker Data
+# MAGIC
+# MAGIC Writes `health_tracker_data_{year}_{month}.json` files in the same JSON-lines
+# MAGIC format as the files fetched by `retrieve_data`, e.g.
+# MAGIC
+# MAGIC ```
+# MAGIC {"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":1.5778368E9}
+# MAGIC ```
+
+# COMMAND ----------
+
+import argparse
+import calendar
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+# COMMAND ----------
+
+FIRST_NAMES = [
+    "Deborah", "Sarah", "James", "Maria", "Robert", "Linda", "Michael", "Karen",
+    "David", "Nancy", "Thomas", "Lisa", "Daniel", "Betty", "Paul", "Sandra",
+    "Mark", "Ashley", "Steven", "Donna",
+]
+LAST_NAMES = [
+    "Powell", "Jones", "Smith", "Garcia", "Miller", "Davis", "Wilson", "Moore",
+    "Taylor", "Thomas", "Lee", "Harris", "Clark", "Lewis", "Young", "Walker",
+    "Hall", "Allen", "King", "Wright",
+]
+DEVICE_TYPES = ["wrist", "chest", "ankle"]
+
+DEVICES_PER_CHUNK = 1000
+
+# COMMAND ----------
+
+def generate_raw_data(
+    raw_path: str,
+    months: list,
+    devices: int = 1000,
+    readings_per_day: int = 24,
+    broken_rate: float = 0.001,
+    broken_run_length: int = 1,
+    late_rate: float = 0.0,
+    late_duplicate_rate: float = 0.0,
+    v2_rate: float = 0.0,
+    seed: int = 42,
+    workers: int = None,
+) -> dict:
+    """Write one raw file per (year, month), plus a late file when late_rate > 0.
+
+    - broken_rate: share of readings that are negative "broken" values, in runs
+      of broken_run_length consecutive readings
+    - late_rate: share of readings withheld from the month file and written to
+      late/health_tracker_data_{year}_{month}_late.json instead, alongside a
+      late_duplicate_rate share of readings that were already delivered
+    - v2_rate: share of devices that also report device_type (schema v2)
+
+    Months are generated in parallel processes. Returns rows written per file.
+    """
+    jobs = [
+        (
+            raw_path,
+            year,
+            month,
+            devices,
+            readings_per_day,
+            broken_rate,
+            broken_run_length,
+            late_rate,
+            late_duplicate_rate,
+            v2_rate,
+            seed + index,
+        )
+        for index, (year, month) in enumerate(months)
+    ]
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for written in executor.map(_generate_month, jobs):
+            results.update(written)
+    return results
+
+
+# COMMAND ----------
+
+def heartrate_series(
+    rng: np.random.Generator, devices: int, hours_of_day: np.ndarray
+) -> np.ndarray:
+    """Per-device resting baseline, a daily cycle peaking mid-afternoon, AR(1) noise."""
+    baseline = rng.normal(68.0, 8.0, size=(devices, 1))
+    amplitude = rng.uniform(4.0, 12.0, size=(devices, 1))
+    daily = amplitude * np.sin((hours_of_day[None, :] - 9.0) / 24.0 * 2 * np.pi)
+
+    shocks = rng.normal(0.0, 2.0, size=(devices, len(hours_of_day)))
+    noise = np.empty_like(shocks)
+    noise[:, 0] = shocks[:, 0]
+    for step in range(1, shocks.shape[1]):
+        noise[:, step] = 0.7 * noise[:, step - 1] + shocks[:, step]
+
+    return np.clip(baseline + daily + noise, 35.0, 200.0)
+
+
+def broken_mask(
+    rng: np.random.Generator, shape: tuple, broken_rate: float, run_length: int
+) -> np.ndarray:
+    starts = rng.random(shape) < broken_rate / run_length
+    mask = starts.copy()
+    for offset in range(1, run_length):
+        mask[:, offset:] |= starts[:, :-offset]
+    return mask
+
+
+# COMMAND ----------
+
+def _generate_month(job: tuple) -> dict:
+    (
+        raw_path,
+        year,
+        month,
+        devices,
+        readings_per_day,
+        broken_rate,
+        broken_run_length,
+        late_rate,
+        late_duplicate_rate,
+        v2_rate,
+        seed,
+    ) = job
+    rng = np.random.default_rng(seed)
+
+    start = datetime(year, month, 1, tzinfo=timezone.utc).timestamp()
+    interval = 86400 // readings_per_day
+    readings = calendar.monthrange(year, month)[1] * readings_per_day
+    times = start + interval * np.arange(readings)
+    time_strings = [_java_float(value) for value in times.astype(np.float32)]
+    hours_of_day = (times % 86400) / 3600.0
+
+    file = f"health_tracker_data_{year}_{month}.json"
+    late_file = f"health_tracker_data_{year}_{month}_late.json"
+    path = os.path.join(raw_path, file)
+    late_path = os.path.join(raw_path, "late", late_file)
+    os.makedirs(raw_path, exist_ok=True)
+
+    written = {file: 0}
+    late_out = None
+    if late_rate > 0 or late_duplicate_rate > 0:
+        os.makedirs(os.path.dirname(late_path), exist_ok=True)
+        written["late/" + late_file] = 0
+        late_out = open(late_path, "w")
+
+    try:
+        with open(path, "w") as out:
+            for first in range(0, devices, DEVICES_PER_CHUNK):
+                last = min(first + DEVICES_PER_CHUNK, devices)
+                device_ids = np.arange(first, last)
+                heartrate = heartrate_series(rng, len(device_ids), hours_of_day)
+                broken = broken_mask(
+                    rng, heartrate.shape, broken_rate, broken_run_length
+                )
+                heartrate = np.where(broken, -heartrate, heartrate)
+
+                late = rng.random(heartrate.shape) < late_rate
+                duplicate = rng.random(heartrate.shape) < late_duplicate_rate
+                redelivered = late | duplicate
+                prefixes = [
+                    _record_prefix(device_id, rng.random() < v2_rate)
+                    for device_id in device_ids
+                ]
+
+                lines = _format_lines(prefixes, heartrate, time_strings, ~late)
+                out.write(lines)
+                written[file] += int((~late).sum())
+                if late_out is not None:
+                    late_out.write(
+                        _format_lines(prefixes, heartrate, time_strings, redelivered)
+                    )
+                    written["late/" + late_file] += int(redelivered.sum())
+    finally:
+        if late_out is not None:
+            late_out.close()
+
+    return written
+
+
+def _record_prefix(device_id: int, v2: bool) -> tuple:
+    device_type = ""
+    if v2:
+        device_type = DEVICE_TYPES[device_id % len(DEVICE_TYPES)]
+        device_type = f'"device_type":"{device_type}",'
+    name = (
+        f"{FIRST_NAMES[device_id % len(FIRST_NAMES)]} "
+        f"{LAST_NAMES[(device_id // len(FIRST_NAMES)) % len(LAST_NAMES)]}"
+    )
+    head = f'{{"device_id":{device_id},{device_type}"heartrate":'
+    tail = f',"name":"{name}","time":'
+    return head, tail
+
+
+def _format_lines(
+    prefixes: list, heartrate: np.ndarray, time_strings: list, keep: np.ndarray
+) -> str:
+    lines = []
+    for (head, tail), values, row_keep in zip(prefixes, heartrate.tolist(), keep):
+        for index in np.flatnonzero(row_keep).tolist():
+            line = f"{head}{values[index]:.10f}{tail}{time_strings[index]}}}\n"
+            lines.append(line)
+    return "".join(lines)
+
+
+def _java_float(value: np.float32) -> str:
+    """Format an epoch like Java's Float.toString, e.g. 1.5778368E9."""
+    mantissa, exponent = f"{float(value):.7E}".split("E")
+    mantissa = mantissa.rstrip("0")
+    if mantissa.endswith("."):
+        mantissa += "0"
+    return f"{mantissa}E{int(exponent)}"
+
+
+# COMMAND ----------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate raw health-tracker files.")
+    parser.add_argument("raw_path")
+    parser.add_argument("--year", type=int, default=2020)
+    parser.add_argument("--months", type=int, default=1)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--broken-rate", type=float, default=0.001)
+    parser.add_argument("--broken-run-length", type=int, default=1)
+    parser.add_argument("--late-rate", type=float, default=0.0)
+    parser.add_argument("--late-duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--v2-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    written = generate_raw_data(
+        args.raw_path,
+        [(args.year, month) for month in range(1, args.months + 1)],
+        devices=args.devices,
+        broken_rate=args.broken_rate,
+        broken_run_length=args.broken_run_length,
+        late_rate=args.late_rate,
+        late_duplicate_rate=args.late_duplicate_rate,
+        v2_rate=args.v2_rate,
+        workers=args.workers,
+    )
+    for file, rows in sorted(written.items()):
+        print(f"{file:>48} {rows:>12,} rows")
@@ -10,17 +10,25 @@ username = FILL_THIS_IN
 
 # COMMAND ----------
 
-plusPipelinePath = f"/dbacademy/{username}/dataengineering/plus/"
+# MAGIC %run ./pipeline_config
 
-rawPath = plusPipelinePath + "raw/"
-bronzePath = plusPipelinePath + "bronze/"
-silverPath = plusPipelinePath + "silver/"
-goldPath = plusPipelinePath + "gold/"
+# COMMAND ----------
+
+# every path, checkpoint, stream and table name derives from the tenant id; more
+# tenants can run in this Spark application with their own PipelineConfig
+config = PipelineConfig(username)
+
+plusPipelinePath = config.plusPipelinePath
+
+rawPath = config.rawPath
+bronzePath = config.bronzePath
+silverPath = config.silverPath
+goldPath = config.goldPath
 
-checkpointPath = plusPipelinePath + "checkpoints/"
-bronzeCheckpoint = checkpointPath + "bronze/"
-silverCheckpoint = checkpointPath + "silver/"
-goldCheckpoint = checkpointPath + "gold/"
+checkpointPath = config.checkpointPath
+bronzeCheckpoint = config.bronzeCheckpoint
+silverCheckpoint = config.silverCheckpoint
+goldCheckpoint = config.goldCheckpoint
 
 # COMMAND ----------
 
@@ -29,8 +37,8 @@ goldCheckpoint = checkpointPath + "gold/"
 
 # COMMAND ----------
 
-spark.sql(f"CREATE DATABASE IF NOT EXISTS dbacademy_{username}")
-spark.sql(f"USE dbacademy_{username}")
+spark.sql(f"CREATE DATABASE IF NOT EXISTS {config.database}")
+spark.sql(f"USE {config.database}")
 
 # COMMAND ----------
 
@@ -43,7 +51,7 @@ spark.sql(f"USE dbacademy_{username}")
 
 # COMMAND ----------
 
-streams_stopped = stop_all_streams()
+streams_stopped = stop_all_streams(config=config)
 
 if streams_stopped:
     print("All streams stopped.")
@@ -0,0 +1,147 @@
+# Databricks notebook source
+# MAGIC
+# MAGIC %md
+# MAGIC # Arrow Engine
+# MAGIC
+# MAGIC `transform_bronze(engine="arrow")` of operations and operations_v2: parses
+# MAGIC the raw JSON `value` with `mapInArrow` instead of `from_json`.
+
+# COMMAND ----------
+
+import io
+import re
+from datetime import timedelta, timezone as fixed_timezone
+
+from pyspark.sql import DataFrame
+from pyspark.sql.pandas.types import to_arrow_schema
+from pyspark.sql.session import SparkSession
+from pyspark.sql.types import DateType, StructField, StructType, TimestampType
+
+# COMMAND ----------
+
+def transform_bronze_arrow(
+    bronze: DataFrame, json_schema: str, columns: list, passthrough: tuple = ()
+) -> DataFrame:
+    """Parse `value` with mapInArrow; passthrough columns of bronze are carried as-is."""
+    bronze = bronze.select("value", *[c for c in passthrough if c != "value"])
+    parsed_schema = ddl_schema(bronze.sparkSession, json_schema)
+    fields = {
+        "eventtime": StructField("eventtime", TimestampType()),
+        "p_eventdate": StructField("p_eventdate", DateType()),
+        **{column: bronze.schema[column] for column in passthrough},
+    }
+    output_schema = StructType(
+        [fields.get(column) or parsed_schema[column] for column in columns]
+    )
+    arrow_schema = to_arrow_schema(parsed_schema)
+    session_timezone = bronze.sparkSession.conf.get("spark.sql.session.timeZone")
+    timezone = arrow_timezone(session_timezone)
+
+    def parse(batches):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        for batch in batches:
+            table = decode_json_lines(batch.column(0).to_pylist(), arrow_schema)
+            # one epoch conversion per row, truncated like from_unixtime(FLOAT)
+            seconds = pc.cast(table.column("time"), pa.int64(), safe=False)
+            seconds = seconds.combine_chunks()
+            eventtime, p_eventdate = epoch_to_event_columns(seconds, timezone)
+            derived = {"eventtime": eventtime, "p_eventdate": p_eventdate}
+            for column in passthrough:
+                derived[column] = batch.column(batch.schema.get_field_index(column))
+            yield pa.RecordBatch.from_arrays(
+                [
+                    derived[column]
+                    if column in derived
+                    else table.column(column).combine_chunks()
+                    for column in columns
+                ],
+                names=columns,
+            )
+
+    return bronze.mapInArrow(parse, output_schema)
+
+
+def ddl_schema(spark: SparkSession, ddl: str) -> StructType:
+    """The StructType of a DDL string, as parsed by Spark; no job is run."""
+    return spark.createDataFrame([], ddl).schema
+
+
+# COMMAND ----------
+
+def decode_json_lines(lines: list, arrow_schema):
+    import pyarrow as pa
+    import pyarrow.json as pa_json
+
+    if lines and all(lines):
+        payload = "\n".join(lines).encode()
+        try:
+            table = pa_json.read_json(
+                io.BytesIO(payload),
+                read_options=pa_json.ReadOptions(block_size=len(payload) + 1),
+                parse_options=pa_json.ParseOptions(
+                    explicit_schema=arrow_schema, unexpected_field_behavior="ignore"
+                ),
+            )
+            if table.num_rows == len(lines):
+                return table.select(arrow_schema.names)
+        except pa.ArrowInvalid:
+            pass
+
+    # slow path: decode line by line so a bad record becomes a null row, as with from_json
+    import orjson
+
+    rows = []
+    for line in lines:
+        try:
+            record = orjson.loads(line) if line else None
+            if isinstance(record, dict):
+                pa.Table.from_pylist([record], schema=arrow_schema)
+            else:
+                record = None
+        except (orjson.JSONDecodeError, pa.ArrowException):
+            record = None
+        rows.append(record or {name: None for name in arrow_schema.names})
+    return pa.Table.from_pylist(rows, schema=arrow_schema)
+
+
+# COMMAND ----------
+
+_UTC_OFFSET = re.compile(r"^(?:GMT|UTC|UT)?([+-])(\d{1,2})(?::?(\d{2}))?$")
+
+
+def arrow_timezone(timezone: str):
+    """A pandas-compatible zone for a Spark session time zone.
+
+    Region ids pass through; Spark's offset forms such as "GMT+08:00", "UTC-5"
+    or "+0530" become fixed offsets, and anything else falls back to UTC.
+    """
+    import pandas as pd
+
+    offset = _UTC_OFFSET.match((timezone or "").strip().upper())
+    if offset is not None:
+        sign, hours, minutes = offset.groups()
+        delta = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        return fixed_timezone(-delta if sign == "-" else delta)
+    try:
+        pd.Timestamp(0, tz=timezone).tz_convert(timezone)
+        return timezone or "UTC"
+    except (TypeError, ValueError, KeyError):
+        return "UTC"
+
+
+def epoch_to_event_columns(seconds, timezone):
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    eventtime = pc.cast(pc.multiply(seconds, 1_000_000), pa.timestamp("us", tz="UTC"))
+    local = (
+        pd.to_datetime(seconds.to_pandas(), unit="s", utc=True)
+        .dt.tz_convert(timezone)
+        .dt.tz_localize(None)
+        .dt.normalize()
+    )
+    p_eventdate = pa.array(local, type=pa.timestamp("ns")).cast(pa.date32())
+    return eventtime, p_eventdate
@@ -0,0 +1,95 @@
+# Databricks notebook source
+# MAGIC
+# MAGIC %md
+# MAGIC # Delta Log
+# MAGIC
+# MAGIC File-level metadata of a Delta table read from its transaction log, so no
+# MAGIC data file is opened.
+
+# COMMAND ----------
+
+from pyspark.sql import DataFrame
+from pyspark.sql.functions import expr
+from pyspark.sql.session import SparkSession
+from pyspark.sql.utils import AnalysisException
+
+# COMMAND ----------
+
+DELTA_LOG_ACTIONS_SCHEMA = (
+    "add STRUCT<path: STRING, partitionValues: MAP<STRING, STRING>, size: BIGINT>, "
+    "remove STRUCT<path: STRING>"
+)
+
+
+def _log_path(path: str) -> str:
+    return path.rstrip("/") + "/_delta_log/"
+
+
+def _log_actions(dataframe: DataFrame) -> DataFrame:
+    # log files are named after the zero-padded version they hold
+    return dataframe.select(
+        expr("cast(substring(_metadata.file_name, 1, 20) AS BIGINT)").alias("version"),
+        "add",
+        "remove",
+    )
+
+
+def _last_checkpoint_version(spark: SparkSession, path: str) -> int:
+    try:
+        return spark.read.json(_log_path(path) + "_last_checkpoint").first()["version"]
+    except AnalysisException:
+        return None
+
+
+# COMMAND ----------
+
+def snapshot_files(spark: SparkSession, path: str) -> DataFrame:
+    """path, partitionValues and size of every file in the current snapshot.
+
+    Replays the add and remove actions from the last checkpoint on.
+    """
+    reader = spark.read.schema(DELTA_LOG_ACTIONS_SCHEMA)
+    actions = _log_actions(reader.json(_log_path(path) + "*.json"))
+    checkpoint_version = _last_checkpoint_version(spark, path)
+    if checkpoint_version is not None:
+        actions = actions.where(f"version > {checkpoint_version}").unionByName(
+            _log_actions(
+                reader.parquet(
+                    f"{_log_path(path)}{checkpoint_version:020d}.checkpoint*.parquet"
+                )
+            )
+        )
+    return (
+        actions.select(
+            "version", expr("coalesce(add.path, remove.path)").alias("path"), "add"
+        )
+        .where("path IS NOT NULL")
+        .groupBy("path")
+        .agg(expr("max(struct(version, add))").alias("latest"))
+        .where("latest.add IS NOT NULL")
+        .select("path", "latest.add.partitionValues", "latest.add.size")
+    )
+
+
+def commit_actions(spark: SparkSession, path: str, version: int) -> DataFrame:
+    """version, add and remove actions of one commit."""
+    return commit_range_actions(spark, path, version, version)
+
+
+def commit_range_actions(
+    spark: SparkSession, path: str, start: int, end: int
+) -> DataFrame:
+    """version, add and remove actions of the commits start..end, both included."""
+    paths = [
+        f"{_log_path(path)}{version:020d}.json" for version in range(start, end + 1)
+    ]
+    return _log_actions(spark.read.schema(DELTA_LOG_ACTIONS_SCHEMA).json(paths))
+
+
+def commit_files(spark: SparkSession, path: str, version: int) -> DataFrame:
+    """path, partitionValues and size of the files added by one commit."""
+    return (
+        commit_actions(spark, path, version)
+        .where("add IS NOT NULL")
+        .select("add.path", "add.partitionValues", "add.size")
+    )
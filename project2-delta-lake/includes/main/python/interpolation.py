@@ -0,0 +1,49 @@
+# Databricks notebook source
+# MAGIC
+# MAGIC %md
+# MAGIC # Interpolation
+# MAGIC
+# MAGIC Per-device repair of broken readings, applied with `applyInPandas` by
+# MAGIC `update_silver_table` of operations and operations_v2.
+
+# COMMAND ----------
+
+def interpolate_device_readings(max_gap_seconds: int):
+    """Time-weighted interpolation of runs of negative readings for one device.
+
+    Each negative reading is replaced by the line between the nearest valid
+    readings before and after it, unless those are more than max_gap_seconds
+    apart. Only the rows that changed are returned.
+    """
+
+    def interpolate(readings):
+        import numpy as np
+
+        readings = readings.sort_values("eventtime", kind="mergesort")
+        heartrate = readings["heartrate"].to_numpy(dtype="float64")
+        seconds = readings["eventtime"].to_numpy().astype("datetime64[s]").astype("int64")
+
+        broken = heartrate < 0
+        valid = ~broken & ~np.isnan(heartrate)
+        positions = np.arange(len(heartrate))
+        previous = np.maximum.accumulate(np.where(valid, positions, -1))
+        following = np.minimum.accumulate(
+            np.where(valid, positions, len(heartrate))[::-1]
+        )[::-1]
+
+        targets = positions[broken & (previous >= 0) & (following < len(heartrate))]
+        before, after = previous[targets], following[targets]
+        gap = seconds[after] - seconds[before]
+        within = (gap > 0) & (gap <= max_gap_seconds)
+        targets, before, after, gap = (
+            targets[within],
+            before[within],
+            after[within],
+            gap[within],
+        )
+
+        weight = (seconds[targets] - seconds[before]) / gap
+        interpolated = heartrate[before] + (heartrate[after] - heartrate[before]) * weight
+        return readings.iloc[targets].assign(heartrate=interpolated)
+
+    return interpolate
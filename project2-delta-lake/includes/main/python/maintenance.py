@@ -0,0 +1,176 @@
+# Databricks notebook source
+
+import threading
+import time
+from datetime import date, timedelta
+
+from delta.tables import DeltaTable
+from pyspark.sql import DataFrame
+from pyspark.sql.functions import avg, col, count, sum
+from pyspark.sql.session import SparkSession
+
+from main.python.delta_log import snapshot_files
+
+# COMMAND ----------
+
+MAINTENANCE_DEFAULTS = {
+    "min_files": 16,
+    "small_file_bytes": 32 * 1024 * 1024,
+    "target_file_bytes": 128 * 1024 * 1024,
+    "grace_days": 1,
+}
+
+OPTIMIZE_MAX_FILE_SIZE_CONF = "spark.databricks.delta.optimize.maxFileSize"
+
+
+def maintenance_tables(bronzePath: str, silverPath: str) -> list:
+    return [
+        {"path": bronzePath, "partition_column": "p_ingestdate"},
+        {
+            "path": silverPath,
+            "partition_column": "p_eventdate",
+            "zorder_by": ["device_id", "eventtime"],
+        },
+    ]
+
+
+# COMMAND ----------
+
+def partition_file_stats(
+    spark: SparkSession, path: str, partition_column: str
+) -> DataFrame:
+    """File count and size per partition of the current Delta snapshot.
+
+    Computed from the add actions in the transaction log; no data is read.
+    """
+    partition_type = spark.read.format("delta").load(path).schema[partition_column]
+    return (
+        snapshot_files(spark, path)
+        .select(
+            col("partitionValues")[partition_column]
+            .cast(partition_type.dataType)
+            .alias(partition_column),
+            col("size").alias("file_size"),
+        )
+        .groupBy(partition_column)
+        .agg(
+            count("*").alias("num_files"),
+            sum("file_size").alias("size_bytes"),
+            avg("file_size").alias("avg_file_bytes"),
+        )
+    )
+
+
+# COMMAND ----------
+
+def compact_table(
+    spark: SparkSession,
+    path: str,
+    partition_column: str,
+    zorder_by: list = None,
+    today: date = None,
+    probe_device_id: int = None,
+    **thresholds,
+) -> dict:
+    """Bin-pack (and optionally Z-order) closed partitions with too many small files.
+
+    A partition is closed once it is more than grace_days old, so the streams
+    appending to today's partitions never contend with the rewrite; OPTIMIZE
+    only commits dataChange=false files and does not conflict with appends.
+    """
+    settings = {**MAINTENANCE_DEFAULTS, **thresholds}
+    closed_before = (today or date.today()) - timedelta(days=settings["grace_days"])
+
+    candidates = [
+        row[partition_column]
+        for row in partition_file_stats(spark, path, partition_column)
+        .where(col(partition_column) < closed_before)
+        .where(
+            (col("num_files") >= settings["min_files"])
+            | (
+                (col("num_files") > 1)
+                & (col("avg_file_bytes") < settings["small_file_bytes"])
+            )
+        )
+        .collect()
+    ]
+    report = {"path": path, "partitions": [str(value) for value in candidates]}
+    if not candidates:
+        return report
+
+    partition_filter = "{} IN ({})".format(
+        partition_column, ", ".join(f"'{value}'" for value in candidates)
+    )
+    report["files_before"] = _count_files(spark, path, partition_filter)
+    report["latency_before"] = _probe_latency(
+        spark, path, partition_filter, probe_device_id
+    )
+
+    # the target size is a session conf; only set it for this OPTIMIZE
+    previous_max_file_size = spark.conf.get(OPTIMIZE_MAX_FILE_SIZE_CONF, None)
+    spark.conf.set(OPTIMIZE_MAX_FILE_SIZE_CONF, settings["target_file_bytes"])
+    try:
+        optimizer = DeltaTable.forPath(spark, path).optimize().where(partition_filter)
+        if zorder_by:
+            optimizer.executeZOrderBy(*zorder_by)
+        else:
+            optimizer.executeCompaction()
+    finally:
+        if previous_max_file_size is None:
+            spark.conf.unset(OPTIMIZE_MAX_FILE_SIZE_CONF)
+        else:
+            spark.conf.set(OPTIMIZE_MAX_FILE_SIZE_CONF, previous_max_file_size)
+
+    report["files_after"] = _count_files(spark, path, partition_filter)
+    report["latency_after"] = _probe_latency(
+        spark, path, partition_filter, probe_device_id
+    )
+    return report
+
+
+def _count_files(spark: SparkSession, path: str, partition_filter: str) -> int:
+    return len(
+        spark.read.format("delta").load(path).where(partition_filter).inputFiles()
+    )
+
+
+def _probe_latency(
+    spark: SparkSession, path: str, partition_filter: str, device_id: int
+) -> float:
+    """Wall time of a typical per-device read over the compacted partitions."""
+    df = spark.read.format("delta").load(path).where(partition_filter)
+    if "device_id" not in df.columns:
+        return None
+    if device_id is None:
+        device_id = df.select("device_id").first()[0]
+    start = time.perf_counter()
+    df.where(col("device_id") == device_id).agg(count("*")).collect()
+    return time.perf_counter() - start
+
+
+# COMMAND ----------
+
+def start_maintenance(
+    spark: SparkSession,
+    tables: list,
+    interval_seconds: int = 3600,
+    on_report=print,
+    **thresholds,
+) -> threading.Event:
+    """Compact the given tables every interval_seconds on a driver thread.
+
+    Runs alongside the active streams. Set the returned event to stop it.
+    """
+    stop = threading.Event()
+
+    def run() -> None:
+        while not stop.is_set():
+            for table in tables:
+                try:
+                    on_report(compact_table(spark, **table, **thresholds))
+                except Exception as error:
+                    on_report({"path": table["path"], "error": repr(error)})
+            stop.wait(interval_seconds)
+
+    threading.Thread(target=run, name="delta-maintenance", daemon=True).start()
+    return stop
@@ -1,84 +1,1366 @@
 # Databricks notebook source
 
+import functools
+import inspect
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from delta.exceptions import ConcurrentAppendException
 from delta.tables import DeltaTable
-from pyspark.sql import DataFrame
+from pyspark.sql import Column, DataFrame
 from pyspark.sql.functions import (
+    abs,
+    broadcast,
     col,
+    count,
     current_timestamp,
+    expr,
     from_json,
     from_unixtime,
     lag,
     lead,
+    length,
     lit,
     mean,
+    pmod,
     stddev,
     max,
+    sqrt,
+    var_pop,
+    when,
+    window,
+    xxhash64,
 )
 from pyspark.sql.session import SparkSession
-from pyspark.sql.streaming import DataStreamWriter
+from pyspark.sql.streaming import DataStreamWriter, StreamingQueryListener
+from pyspark.sql.streaming.state import GroupStateTimeout
+from pyspark.sql.utils import AnalysisException
 from pyspark.sql.window import Window
 
+from main.python.arrow_engine import transform_bronze_arrow
+from main.python.delta_log import commit_actions, commit_range_actions
+from main.python.interpolation import interpolate_device_readings
+from main.python.schema_registry import (
+    HEALTH_TRACKER_SCHEMAS,
+    register_schema,
+    schema_fields,
+    schema_version_column,
+    union_schema_fields,
+)
+from main.python.stream_profiles import apply_trigger, rate_limit_options
+
+# COMMAND ----------
+
+def accepts_pipeline_config(function):
+    """Let function take config=PipelineConfig in place of per-tenant arguments.
+
+    Arguments not passed explicitly are filled from the config attribute of the
+    same name (silverPath, goldPath, metricsPath, ...), name is scoped to the
+    tenant, and a missing checkpoint becomes the tenant's checkpoint for name.
+    With a config, those config-backed arguments must be passed by keyword:
+    positional ones bind before the config fills anything in, so a skipped
+    path would silently shift the rest, and a TypeError is raised instead.
+    """
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, config=None, **kwargs):
+        if config is None:
+            return function(*args, **kwargs)
+        backed = {}
+        for parameter in signature.parameters:
+            value = getattr(config, parameter, None)
+            if value is not None and not callable(value):
+                backed[parameter] = value
+        positional = [
+            parameter
+            for parameter in list(signature.parameters)[: len(args)]
+            if parameter in backed
+        ]
+        if positional:
+            raise TypeError(
+                f"{function.__name__}() takes {', '.join(positional)} from config; "
+                "pass it by keyword to override the config"
+            )
+        bound = signature.bind_partial(*args, **kwargs)
+        arguments = bound.arguments
+        for parameter, value in backed.items():
+            arguments.setdefault(parameter, value)
+        if arguments.get("name") is not None:
+            if "checkpoint" in signature.parameters and "checkpoint" not in arguments:
+                arguments["checkpoint"] = config.checkpoint(arguments["name"])
+            arguments["name"] = config.stream_name(arguments["name"])
+        return function(*bound.args, **bound.kwargs)
+
+    return wrapper
+
+
 # COMMAND ----------
 
+@accepts_pipeline_config
 def create_stream_writer(
     dataframe: DataFrame,
     checkpoint: str,
     name: str,
-    partition_column: str = None,
+    partition_column=None,
     mode: str = "append",
+    trigger: dict = None,
+    profile: str = None,
+    mergeSchema: bool = None,
+    compression: str = None,
+    layout: str = None,
+    silverPath: str = None,
+    partition_bytes: int = None,
 ) -> DataStreamWriter:
 
+    # a silver writer given a layout partitions by it, creating the table at
+    # silverPath when needed; an existing table keeps its own layout and buckets
+    if layout is not None:
+        if silverPath is None:
+            raise ValueError("A silver layout needs the silverPath it is written to")
+        spark = dataframe.sparkSession
+        create_silver_table(spark, silverPath, dataframe, layout, partition_bytes)
+        table_layout, buckets = _silver_table_layout(spark, silverPath)
+        layout = table_layout or layout
+        dataframe = apply_silver_layout(dataframe, layout, buckets)
+        partition_column = SILVER_LAYOUTS[layout]
+
     stream_writer = (
         dataframe.writeStream.format("delta")
         .outputMode(mode)
         .option("checkpointLocation", checkpoint)
         .queryName(name)
     )
+    _track_stream(name, stream_writer)
+
+    if compression is not None:
+        stream_writer = stream_writer.option("compression", compression)
+
+    # versioned silver picks up the columns of newly registered schema versions
+    if mergeSchema is None:
+        mergeSchema = "schema_version" in dataframe.columns
+    if mergeSchema:
+        stream_writer = stream_writer.option("mergeSchema", True)
+
+    stream_writer = apply_trigger(stream_writer, trigger, profile)
     if partition_column is not None:
-        return stream_writer.partitionBy(partition_column)
+        return stream_writer.partitionBy(*_as_list(partition_column))
     return stream_writer
 
 
+def _as_list(columns) -> list:
+    return [columns] if isinstance(columns, str) else list(columns)
+
+
 # COMMAND ----------
 
-def read_stream_delta(spark: SparkSession, deltaPath: str) -> DataFrame:
-    return spark.readStream.format("delta").load(deltaPath)
+TXN_APP_ID_CONF = "spark.databricks.delta.write.txnAppId"
+TXN_VERSION_CONF = "spark.databricks.delta.write.txnVersion"
+
+
+class IdempotentBatch:
+    """The Delta writes of one foreachBatch micro-batch.
+
+    Every commit is tagged with txnAppId/txnVersion = (app id, batch id): the
+    DataFrame writer options for appends and overwrites, the equivalent session
+    confs for MERGE/UPDATE/DELETE. Delta records the last version per app id in
+    each table, so when a failed batch is retried, the writes that already
+    committed are skipped instead of applied twice. A table written more than
+    once per batch gets a distinct app id for each write.
+    """
+
+    def __init__(self, spark: SparkSession, app_id: str, batch_id: int):
+        self.spark = spark
+        self.app_id = app_id
+        self.batch_id = batch_id
+        self._writes = {}
+
+    def append(
+        self,
+        dataframe: DataFrame,
+        path: str,
+        partition_column=None,
+        mergeSchema: bool = False,
+        compression: str = None,
+    ) -> None:
+        self._save(
+            dataframe, path, "append", partition_column, mergeSchema, compression
+        )
+
+    def overwrite(
+        self,
+        dataframe: DataFrame,
+        path: str,
+        partition_column=None,
+        replaceWhere: str = None,
+    ) -> None:
+        options = {} if replaceWhere is None else {"replaceWhere": replaceWhere}
+        self._save(dataframe, path, "overwrite", partition_column, **options)
+
+    def run(self, path: str, operation) -> None:
+        """Call operation(), which runs a single MERGE/UPDATE/DELETE on path."""
+        conf = self.spark.conf
+        conf.set(TXN_APP_ID_CONF, self._txn_app_id(path))
+        conf.set(TXN_VERSION_CONF, str(self.batch_id))
+        try:
+            operation()
+        finally:
+            conf.unset(TXN_APP_ID_CONF)
+            conf.unset(TXN_VERSION_CONF)
+
+    def _save(
+        self,
+        dataframe: DataFrame,
+        path: str,
+        mode: str,
+        partition_column=None,
+        mergeSchema: bool = False,
+        compression: str = None,
+        **options,
+    ) -> None:
+        writer = (
+            dataframe.write.format("delta")
+            .mode(mode)
+            .option("txnAppId", self._txn_app_id(path))
+            .option("txnVersion", self.batch_id)
+            .option("mergeSchema", mergeSchema)
+            .options(**options)
+        )
+        if compression is not None:
+            writer = writer.option("compression", compression)
+        if partition_column is not None:
+            writer = writer.partitionBy(*_as_list(partition_column))
+        writer.save(path)
+
+    def _txn_app_id(self, path: str) -> str:
+        writes = self._writes[path] = self._writes.get(path, 0) + 1
+        return self.app_id if writes == 1 else f"{self.app_id}#{writes}"
+
+
+@accepts_pipeline_config
+def create_idempotent_stream_writer(
+    dataframe: DataFrame,
+    checkpoint: str,
+    name: str,
+    write_batch,
+    trigger: dict = None,
+    profile: str = None,
+) -> DataStreamWriter:
+    """A foreachBatch query calling write_batch(batchDF, batch: IdempotentBatch).
+
+    All writes made through batch are exactly-once across restarts, as long as
+    write_batch issues them in the same order for the same batch. The app id is
+    the query name plus the query id kept in the checkpoint, so after a
+    checkpoint reset the batch ids starting over at 0 are not taken for retries.
+    """
+    app_ids = {}
+
+    def run_batch(batchDF: DataFrame, batch_id: int) -> None:
+        spark = batchDF.sparkSession
+        if checkpoint not in app_ids:
+            metadata = spark.read.json(checkpoint.rstrip("/") + "/metadata").first()
+            app_ids[checkpoint] = f"{name}-{metadata['id']}"
+        write_batch(batchDF, IdempotentBatch(spark, app_ids[checkpoint], batch_id))
+
+    stream_writer = (
+        dataframe.writeStream.foreachBatch(run_batch)
+        .option("checkpointLocation", checkpoint)
+        .queryName(name)
+    )
+    _track_stream(name, stream_writer)
+    return apply_trigger(stream_writer, trigger, profile)
 
 
 # COMMAND ----------
 
-def read_stream_raw(spark: SparkSession, rawPath: str) -> DataFrame:
+@accepts_pipeline_config
+def create_medallion_stream_writer(
+    dataframe: DataFrame,
+    checkpoint: str,
+    name: str,
+    bronzePath: str,
+    silverPath: str,
+    goldPath: str,
+    trigger: dict = None,
+    profile: str = None,
+    layout: str = "date",
+    parsed_bronze: bool = False,
+) -> DataStreamWriter:
+    """Run raw -> bronze -> silver -> gold as a single foreachBatch query.
+
+    Each raw micro-batch is transformed and persisted once, appended to bronze
+    and silver, and the gold aggregates of the devices it touched are
+    recomputed and merged, all through an IdempotentBatch so a retried batch
+    is skipped. With parsed_bronze, bronze also stores the typed columns so
+    later silver rebuilds skip parsing.
+    """
+    compression = BRONZE_PAYLOAD_COMPRESSION if parsed_bronze else None
+
+    def write_batch(batchDF: DataFrame, batch: IdempotentBatch) -> None:
+        spark = batchDF.sparkSession
+        bronzeDF = transform_raw(batchDF, parsed=parsed_bronze).persist()
+        silverDF = transform_bronze(bronzeDF).persist()
+        try:
+            batch.append(bronzeDF, bronzePath, "p_ingestdate", compression=compression)
+            _append_silver_batch(batch, silverDF, silverPath, layout)
+
+            goldDF = transform_silver_mean_agg(
+                read_silver(spark, silverPath, silverDF.select("device_id"))
+            )
+            _upsert_gold(batch, goldPath, goldDF)
+        finally:
+            silverDF.unpersist()
+            bronzeDF.unpersist()
+
+    return create_idempotent_stream_writer(
+        dataframe, checkpoint, name, write_batch, trigger, profile
+    )
+
+
+def _upsert_gold(
+    batch: IdempotentBatch,
+    goldPath: str,
+    goldDF: DataFrame,
+    keys: tuple = ("device_id",),
+    partition_column: str = None,
+    prune: str = None,
+) -> None:
+    if not DeltaTable.isDeltaTable(batch.spark, goldPath):
+        batch.overwrite(goldDF, goldPath, partition_column)
+        return
+    merge = (
+        DeltaTable.forPath(batch.spark, goldPath)
+        .alias("gold")
+        .merge(
+            goldDF.alias("updates"),
+            " AND ".join(
+                ([prune] if prune else [])
+                + [f"gold.{key} = updates.{key}" for key in keys]
+            ),
+        )
+        .whenMatchedUpdateAll()
+        .whenNotMatchedInsertAll()
+    )
+    batch.run(goldPath, merge.execute)
+
+
+def _append_silver_batch(
+    batch: IdempotentBatch,
+    silverDF: DataFrame,
+    silverPath: str,
+    layout: str,
+    mergeSchema: bool = False,
+) -> None:
+    # an existing table keeps the layout and bucket count it was created with;
+    # a new bucketed table is sized from the largest date of the first batch
+    table_layout, buckets = _silver_table_layout(batch.spark, silverPath)
+    if table_layout is None:
+        partition_bytes = None
+        if "p_device_bucket" in SILVER_LAYOUTS[layout]:
+            partition_bytes = _largest_partition_bytes(silverDF)
+        create_silver_table(batch.spark, silverPath, silverDF, layout, partition_bytes)
+        table_layout, buckets = _silver_table_layout(batch.spark, silverPath)
+    layout = table_layout or layout
+    batch.append(
+        apply_silver_layout(silverDF, layout, buckets),
+        silverPath,
+        SILVER_LAYOUTS[layout],
+        mergeSchema,
+    )
+    _refresh_file_index(batch.spark, silverPath)
+
+
+# COMMAND ----------
+
+@accepts_pipeline_config
+def create_incremental_gold_writer(
+    dataframe: DataFrame,
+    checkpoint: str,
+    name: str,
+    statePath: str,
+    goldPath: str,
+    trigger: dict = None,
+    profile: str = None,
+) -> DataStreamWriter:
+    """Maintain the heart-rate gold table from a mergeable per-device state table.
+
+    Every silver micro-batch is reduced to per-device partial aggregates, folded
+    into the state at statePath with merge_gold_state and the gold rows of the
+    devices it touched are rebuilt from that state, so a batch costs O(batch)
+    rather than O(history). The state table is tied to this query's checkpoint.
+    """
+
+    def write_batch(batchDF: DataFrame, batch: IdempotentBatch) -> None:
+        spark = batchDF.sparkSession
+        partialDF = transform_silver_partial_agg(batchDF).persist()
+        try:
+            merge_gold_state(spark, statePath, partialDF, batch)
+            stateDF = spark.read.format("delta").load(statePath)
+            goldDF = transform_gold_state(
+                stateDF.join(partialDF.select("device_id"), "device_id", "left_semi")
+            )
+            _upsert_gold(batch, goldPath, goldDF)
+        finally:
+            partialDF.unpersist()
+
+    return create_idempotent_stream_writer(
+        dataframe, checkpoint, name, write_batch, trigger, profile
+    )
+
+
+# COMMAND ----------
+
+@accepts_pipeline_config
+def create_rolling_gold_writer(
+    dataframe: DataFrame,
+    checkpoint: str,
+    name: str,
+    goldPath: str,
+    window_days: int = 30,
+    watermark: str = "1 day",
+    trigger: dict = None,
+    profile: str = None,
+) -> DataStreamWriter:
+    """Upsert the sliding window_days aggregates of a silver stream into goldPath.
+
+    The aggregation runs in update mode, so each micro-batch only carries the
+    windows its readings touched, and those rows are merged into a gold table
+    partitioned by window_end.
+    """
+
+    def write_batch(batchDF: DataFrame, batch: IdempotentBatch) -> None:
+        window_ends = [
+            row.window_end for row in batchDF.select("window_end").distinct().collect()
+        ]
+        if not window_ends:
+            return
+        _upsert_gold(
+            batch,
+            goldPath,
+            batchDF,
+            keys=("device_id", "window_days", "window_end"),
+            partition_column="window_end",
+            prune="gold.window_end IN ({})".format(
+                ", ".join(f"DATE'{window_end}'" for window_end in window_ends)
+            ),
+        )
+
+    return create_idempotent_stream_writer(
+        transform_silver_rolling_agg(dataframe, window_days, watermark),
+        checkpoint,
+        name,
+        write_batch,
+        trigger,
+        profile,
+    ).outputMode("update")
+
+
+# COMMAND ----------
+
+@accepts_pipeline_config
+def create_quarantine_stream_writer(
+    dataframe: DataFrame,
+    checkpoint: str,
+    name: str,
+    silverPath: str,
+    quarantinePath: str,
+    versioned: bool = False,
+    trigger: dict = None,
+    profile: str = None,
+    on_report=print,
+    layout: str = "date",
+) -> DataStreamWriter:
+    """Split each bronze micro-batch between silver and a quarantine table.
+
+    The batch is validated and persisted once; records with a parse_error go
+    to quarantinePath with their original value, and the rest to silver.
+    on_report receives the per-batch row counts and bad-record rate.
+    """
+
+    def write_batch(batchDF: DataFrame, batch: IdempotentBatch) -> None:
+        validatedDF = transform_bronze_validated(batchDF, versioned).persist()
+        try:
+            counts = validatedDF.agg(
+                count("*").alias("rows"), count("parse_error").alias("quarantined")
+            ).first()
+            _append_silver_batch(
+                batch,
+                validatedDF.where(col("parse_error").isNull()).drop(
+                    "value", "p_ingestdate", "parse_error"
+                ),
+                silverPath,
+                layout,
+                mergeSchema=versioned,
+            )
+            batch.append(
+                validatedDF.where(col("parse_error").isNotNull()).select(
+                    "value",
+                    "parse_error",
+                    lit(batch.batch_id).alias("batch_id"),
+                    current_timestamp().alias("quarantinetime"),
+                    "p_ingestdate",
+                ),
+                quarantinePath,
+                "p_ingestdate",
+            )
+        finally:
+            validatedDF.unpersist()
+
+        bad_record_rate = counts.quarantined / counts.rows if counts.rows else 0.0
+        on_report(
+            {
+                "name": name,
+                "batch_id": batch.batch_id,
+                "rows": counts.rows,
+                "quarantined": counts.quarantined,
+                "bad_record_rate": bad_record_rate,
+            }
+        )
+
+    return create_idempotent_stream_writer(
+        dataframe, checkpoint, name, write_batch, trigger, profile
+    )
+
+
+# COMMAND ----------
+
+@accepts_pipeline_config
+def create_late_arrival_stream_writer(
+    dataframe: DataFrame,
+    checkpoint: str,
+    name: str,
+    bronzePath: str,
+    trigger: dict = None,
+    profile: str = None,
+) -> DataStreamWriter:
+    """Insert late raw readings into bronze, from where the silver stream picks them up.
+
+    dataframe is a raw text stream of the late directory. Each de-duplicated
+    micro-batch is merged into bronze with merge_late_arrivals, which only
+    inserts records not there yet and so rewrites no existing files: the
+    running bronze to silver stream reads the added files like any other
+    append and carries the readings to silver on its next trigger, and a
+    replay_silver of those dates rebuilds them too. Silver is deliberately not
+    written here, as the stream would then append the same readings a second
+    time. No streaming watermark is involved, so a reading is never dropped
+    for being late.
+    """
+
+    def write_batch(batchDF: DataFrame, batch: IdempotentBatch) -> None:
+        spark = batch.spark
+        rawDF = batchDF.dropDuplicates(["value"]).persist()
+        try:
+            batch.run(
+                bronzePath, lambda: merge_late_arrivals(spark, bronzePath, rawDF)
+            )
+        finally:
+            rawDF.unpersist()
+
+    return create_idempotent_stream_writer(
+        dataframe, checkpoint, name, write_batch, trigger, profile
+    )
+
+
+# COMMAND ----------
+
+@accepts_pipeline_config
+def create_anomaly_stream_writer(
+    dataframe: DataFrame,
+    checkpoint: str,
+    name: str,
+    goldPath: str,
+    alertsPath: str,
+    alpha: float = 0.1,
+    threshold: float = 3.0,
+    ewma_threshold: float = 2.0,
+    refresh_seconds: float = 3600.0,
+    trigger: dict = None,
+    profile: str = None,
+) -> DataStreamWriter:
+    """Append the abnormal readings of a silver stream to an alerts table.
+
+    Per-device EWMAs live in the query's state store and the gold baseline is
+    a cached broadcast copy reloaded every refresh_seconds, so a micro-batch
+    costs O(batch) and reads neither gold nor silver history.
+    """
+    baseline = GoldBaseline(goldPath, refresh_seconds)
+
+    def write_batch(batchDF: DataFrame, batch: IdempotentBatch) -> None:
+        alertsDF = flag_anomalies(
+            batchDF, baseline.get(batch.spark), threshold, ewma_threshold
+        ).withColumn("alerttime", current_timestamp())
+        batch.append(alertsDF, alertsPath, "p_eventdate")
+
+    return create_idempotent_stream_writer(
+        transform_silver_ewma(dataframe, alpha),
+        checkpoint,
+        name,
+        write_batch,
+        trigger,
+        profile,
+    )
+
+
+# COMMAND ----------
+
+def merge_gold_state(
+    spark: SparkSession,
+    statePath: str,
+    partialDF: DataFrame,
+    batch: IdempotentBatch = None,
+) -> None:
+    """Fold per-device partial aggregates into the state table.
+
+    Given an IdempotentBatch the commit carries its txnAppId/txnVersion, so a
+    retried batch that already folded into the state is skipped outright. The
+    state is tied to the query's checkpoint: a query restarted from a fresh
+    checkpoint must start from a fresh state table as well.
+    """
+    if not DeltaTable.isDeltaTable(spark, statePath):
+        if batch is None:
+            partialDF.write.format("delta").save(statePath)
+        else:
+            batch.append(partialDF, statePath)
+        return
+
+    merge = (
+        DeltaTable.forPath(spark, statePath)
+        .alias("state")
+        .merge(partialDF.alias("updates"), "state.device_id = updates.device_id")
+        .whenMatchedUpdate(set=HEARTRATE_STATE_MERGE)
+        .whenNotMatchedInsertAll()
+    )
+    if batch is None:
+        merge.execute()
+    else:
+        batch.run(statePath, merge.execute)
+
+
+# COMMAND ----------
+
+@accepts_pipeline_config
+def merge_late_arrivals(
+    spark: SparkSession, bronzePath: str, lateRawDF: DataFrame, min_ingestdate: str = None
+) -> dict:
+    """Insert late raw records into bronze unless an identical value already exists.
+
+    Matching is done on the fixed-width (value_hash, value_length) key emitted by
+    transform_raw(with_hash=True), falling back to hashing bronze on the fly for
+    tables written without it. Rows written before value_hash was added have a
+    null hash; late records matching one of them on (device_id, eventtime) are
+    dropped by an anti join first, so the MERGE condition stays a plain
+    conjunction Spark can plan as an equi-join. A record cannot be ingested
+    before it happened, so the target is pruned to p_ingestdate >= the earliest
+    event date in the late batch unless min_ingestdate is given. Works on raw
+    and parsed bronze. Returns the MERGE file metrics.
+    """
+    bronzeTable = DeltaTable.forPath(spark, bronzePath)
+    target_columns = bronzeTable.toDF().columns
+    lateDF = transform_raw(lateRawDF, with_hash=True, parsed=True)
+
+    if min_ingestdate is None:
+        min_ingestdate = lateDF.selectExpr("min(p_eventdate)").first()[0]
+
+    if "value_hash" in target_columns:
+        lateDF = lateDF.alias("latearrivals").join(
+            _legacy_bronze_keys(bronzeTable.toDF(), min_ingestdate).alias("legacy"),
+            expr(
+                "latearrivals.device_id <=> legacy.device_id"
+                " AND latearrivals.eventtime <=> legacy.eventtime"
+            ),
+            "left_anti",
+        )
+        key_match = """
+        bronze.value_hash = latearrivals.value_hash
+        AND bronze.value_length = latearrivals.value_length
+        AND bronze.value = latearrivals.value
+        """
+    else:
+        key_match = """
+        xxhash64(bronze.value) = latearrivals.value_hash
+        AND length(bronze.value) = latearrivals.value_length
+        AND bronze.value = latearrivals.value
+        """
+    existing_record_match = (
+        f"{_ingestdate_prune(min_ingestdate, 'bronze.')} AND {key_match}"
+    )
+
+    (
+        bronzeTable.alias("bronze")
+        .merge(lateDF.alias("latearrivals"), existing_record_match)
+        .whenNotMatchedInsert(
+            values={
+                column: f"latearrivals.{column}"
+                for column in target_columns
+                if column in lateDF.columns
+            }
+        )
+        .execute()
+    )
+
+    return _last_operation_metrics(
+        bronzeTable,
+        [
+            "numTargetFilesBeforeSkipping",
+            "numTargetFilesAfterSkipping",
+            "numTargetFilesAdded",
+            "numTargetFilesRemoved",
+            "numTargetRowsInserted",
+        ],
+    )
+
+
+def _ingestdate_prune(min_ingestdate, prefix: str = "") -> str:
+    if min_ingestdate is None:
+        return "true"
+    return f"{prefix}p_ingestdate >= cast('{min_ingestdate}' AS DATE)"
+
+
+def _legacy_bronze_keys(bronze: DataFrame, min_ingestdate) -> DataFrame:
+    # (device_id, eventtime) of the bronze rows written before value_hash existed
+    if set(PARSED_BRONZE_COLUMNS) <= set(bronze.columns):
+        keys = ["device_id", "eventtime"]
+    else:
+        keys = [
+            "cast(get_json_object(value, '$.device_id') AS INT) AS device_id",
+            """cast(from_unixtime(
+                cast(get_json_object(value, '$.time') AS FLOAT)
+            ) AS TIMESTAMP) AS eventtime""",
+        ]
+    return bronze.where(
+        f"value_hash IS NULL AND {_ingestdate_prune(min_ingestdate)}"
+    ).selectExpr(*keys)
+
+
+def _last_operation_metrics(table: DeltaTable, metrics: list) -> dict:
+    operation_metrics = table.history(1).select("operationMetrics").first()[0] or {}
+    return {
+        metric: int(operation_metrics[metric])
+        for metric in metrics
+        if metric in operation_metrics
+    }
+
+
+# COMMAND ----------
+
+def read_stream_delta(
+    spark: SparkSession,
+    deltaPath: str,
+    profile: str = None,
+    maxFilesPerTrigger: int = None,
+    maxBytesPerTrigger: str = None,
+) -> DataFrame:
+    options = rate_limit_options(
+        profile,
+        maxFilesPerTrigger=maxFilesPerTrigger,
+        maxBytesPerTrigger=maxBytesPerTrigger,
+    )
+    return spark.readStream.format("delta").options(**options).load(deltaPath)
+
+
+# COMMAND ----------
+
+@accepts_pipeline_config
+def read_stream_raw(
+    spark: SparkSession,
+    rawPath: str,
+    profile: str = None,
+    maxFilesPerTrigger: int = None,
+) -> DataFrame:
+    # the text file source only supports a file-count limit, not maxBytesPerTrigger
     kafka_schema = "value STRING"
-    return spark.readStream.format("text").schema(kafka_schema).load(rawPath)
+    options = rate_limit_options(profile, maxFilesPerTrigger=maxFilesPerTrigger)
+    options.pop("maxBytesPerTrigger", None)
+    return (
+        spark.readStream.format("text")
+        .schema(kafka_schema)
+        .options(**options)
+        .load(rawPath)
+    )
+
+
+# COMMAND ----------
+
+SILVER_DEVICE_BUCKETS = 16
+
+# a bucket only pays off once a date partition holds about a file of this size
+# per bucket; smaller partitions get fewer buckets, so no tiny files
+SILVER_BUCKET_TARGET_BYTES = 128 * 1024 * 1024
+
+# rough Parquet size of one silver row, to size buckets from a row count
+SILVER_ROW_BYTES = 32
+
+# table property holding the bucket count of a device_bucketed silver table
+SILVER_DEVICE_BUCKETS_PROPERTY = "healthtracker.silver.deviceBuckets"
+
+# partition columns of each silver layout; device_bucketed hashes device_id into
+# up to SILVER_DEVICE_BUCKETS directories inside every date partition
+SILVER_LAYOUTS = {
+    "date": ["p_eventdate"],
+    "device_bucketed": ["p_eventdate", "p_device_bucket"],
+}
+
+
+def device_bucket(device_id, buckets: int = SILVER_DEVICE_BUCKETS) -> Column:
+    if not isinstance(device_id, Column):
+        device_id = lit(device_id)
+    return pmod(xxhash64(device_id.cast("int")), lit(buckets))
+
+
+def device_buckets_for(partition_bytes: int) -> int:
+    """Buckets per date partition so each holds about SILVER_BUCKET_TARGET_BYTES."""
+    buckets = -(-int(partition_bytes) // SILVER_BUCKET_TARGET_BYTES)
+    return min(SILVER_DEVICE_BUCKETS, buckets) if buckets > 1 else 1
+
+
+def apply_silver_layout(
+    silver: DataFrame, layout: str = "date", buckets: int = None
+) -> DataFrame:
+    """Add the partition columns of layout and cluster each file by device.
+
+    buckets is the bucket count of the target table, SILVER_DEVICE_BUCKETS if
+    not given. Streaming frames cannot be sorted, so a streaming silver writer
+    only gets the bucket column; foreachBatch and batch writers also get the
+    clustering.
+    """
+    if layout not in SILVER_LAYOUTS:
+        raise ValueError(
+            f"Unknown silver layout {layout!r}, expected one of {list(SILVER_LAYOUTS)}"
+        )
+    if "p_device_bucket" not in SILVER_LAYOUTS[layout]:
+        return silver
+    silver = silver.withColumn(
+        "p_device_bucket",
+        device_bucket(col("device_id"), buckets or SILVER_DEVICE_BUCKETS),
+    )
+    if silver.isStreaming:
+        return silver
+    return silver.sortWithinPartitions("device_id", "eventtime")
+
+
+@accepts_pipeline_config
+def create_silver_table(
+    spark: SparkSession,
+    silverPath: str,
+    silver: DataFrame,
+    layout: str = "date",
+    partition_bytes: int = None,
+) -> None:
+    """Create an empty silver table with the columns of silver, laid out by layout.
+
+    A device_bucketed table stores its bucket count as a table property, sized
+    from partition_bytes, the expected size of one date partition; without it
+    the table gets SILVER_DEVICE_BUCKETS. An existing table is left as it is.
+    """
+    buckets = SILVER_DEVICE_BUCKETS
+    if partition_bytes is not None:
+        buckets = device_buckets_for(partition_bytes)
+    builder = (
+        DeltaTable.createIfNotExists(spark)
+        .location(silverPath)
+        .addColumns(apply_silver_layout(silver, layout, buckets).schema)
+        .partitionedBy(*SILVER_LAYOUTS[layout])
+    )
+    if "p_device_bucket" in SILVER_LAYOUTS[layout]:
+        builder = builder.property(SILVER_DEVICE_BUCKETS_PROPERTY, str(buckets))
+    builder.execute()
+
+
+@accepts_pipeline_config
+def silver_layout(spark: SparkSession, silverPath: str) -> str:
+    """Layout of the silver table at silverPath, None if it does not exist yet."""
+    return _silver_table_layout(spark, silverPath)[0]
+
+
+@accepts_pipeline_config
+def silver_device_buckets(spark: SparkSession, silverPath: str) -> int:
+    """Bucket count of a device_bucketed silver table, None for other layouts."""
+    return _silver_table_layout(spark, silverPath)[1]
+
+
+def _silver_table_layout(spark: SparkSession, silverPath: str) -> tuple:
+    if not DeltaTable.isDeltaTable(spark, silverPath):
+        return None, None
+    detail = DeltaTable.forPath(spark, silverPath).detail().first()
+    partition_columns = list(detail.partitionColumns)
+    for layout, layout_columns in SILVER_LAYOUTS.items():
+        if partition_columns == layout_columns:
+            if "p_device_bucket" not in layout_columns:
+                return layout, None
+            # tables bucketed before the count was stored used the maximum
+            buckets = (detail.properties or {}).get(SILVER_DEVICE_BUCKETS_PROPERTY)
+            return layout, int(buckets or SILVER_DEVICE_BUCKETS)
+    return None, None
+
+
+def _largest_partition_bytes(silverDF: DataFrame) -> int:
+    largest = silverDF.groupBy("p_eventdate").count().agg(max("count")).first()[0]
+    return (largest or 0) * SILVER_ROW_BYTES
+
+
+@accepts_pipeline_config
+def read_silver(
+    spark: SparkSession, silverPath: str, devices: DataFrame = None
+) -> DataFrame:
+    """Silver, optionally restricted to the device_id values in devices.
+
+    On a device_bucketed table the restriction is a join on the bucket
+    partition column too, so dynamic partition pruning skips the directories
+    of every other bucket.
+    """
+    silverDF = spark.read.format("delta").load(silverPath)
+    if devices is None:
+        return silverDF
+    devices = devices.select("device_id").distinct()
+    buckets = silver_device_buckets(spark, silverPath)
+    if buckets is None:
+        return silverDF.join(devices, "device_id", "left_semi")
+    devices = devices.withColumn(
+        "p_device_bucket", device_bucket(col("device_id"), buckets)
+    )
+    return silverDF.join(devices, ["p_device_bucket", "device_id"], "left_semi")
+
+
+# COMMAND ----------
+
+def file_index_path(silverPath: str) -> str:
+    return silverPath.rstrip("/") + "_file_index"
+
+
+# silver version whose files are all in the index; later commits are read from
+# the Delta log by read_device_range
+FILE_INDEX_VERSION_PROPERTY = "healthtracker.fileIndex.silverVersion"
+
+
+@accepts_pipeline_config
+def update_file_index(spark: SparkSession, silverPath: str) -> int:
+    """Sync the sidecar index of per-file device_id/eventtime ranges with silver.
+
+    Only files added since the last sync are read, and rows of files that a
+    MERGE or OPTIMIZE removed are deleted. Delta data file names carry a UUID,
+    so the index is keyed on the file name. Once the index exists, the silver
+    writers in this module keep it up to date. Returns the files indexed.
+    """
+    indexPath = file_index_path(silverPath)
+    version = _latest_version(spark, silverPath)
+    files = _silver_files(spark, silverPath, version)
+
+    indexed = set()
+    if DeltaTable.isDeltaTable(spark, indexPath):
+        indexed = {
+            row.file_name
+            for row in spark.read.format("delta")
+            .load(indexPath)
+            .select("file_name")
+            .collect()
+        }
+        removed = list(indexed - set(files))
+        if removed:
+            DeltaTable.forPath(spark, indexPath).delete(
+                col("file_name").isin(removed)
+            )
+
+    new_files = [file_name for file_name in files if file_name not in indexed]
+    if new_files or not indexed:
+        _index_silver_files(spark, silverPath, new_files)
+    _set_file_index_version(spark, indexPath, version)
+    return len(new_files)
+
+
+def _index_silver_files(
+    spark: SparkSession, silverPath: str, file_names: list, event_dates: list = None
+) -> None:
+    silverDF = _read_silver_files(spark, silverPath, file_names, event_dates)
+    (
+        silverDF.groupBy(col("_metadata.file_name").alias("file_name"))
+        .agg(
+            expr("min(p_eventdate)").alias("p_eventdate"),
+            expr("min(device_id)").alias("min_device_id"),
+            max("device_id").alias("max_device_id"),
+            expr("min(eventtime)").alias("min_eventtime"),
+            max("eventtime").alias("max_eventtime"),
+            count("*").alias("num_rows"),
+        )
+        .write.format("delta")
+        .mode("append")
+        .save(file_index_path(silverPath))
+    )
+
+
+@accepts_pipeline_config
+def read_device_range(
+    spark: SparkSession,
+    silverPath: str,
+    device_id: int,
+    start: datetime,
+    end: datetime,
+) -> DataFrame:
+    """Readings of device_id with start <= eventtime <= end.
+
+    The index is queried for the files whose ranges can contain the readings,
+    and files committed since its last sync are taken from the Delta log. The
+    silver scan is then restricted to the partitions of those files, so Delta
+    only opens them, and the lookup never lists the whole table.
+    """
+    in_range = (
+        (col("device_id") == device_id)
+        & (col("eventtime") >= lit(start))
+        & (col("eventtime") <= lit(end))
+        & col("p_eventdate").between(lit(start).cast("date"), lit(end).cast("date"))
+    )
+    silverDF = spark.read.format("delta").load(silverPath).where(in_range)
+    indexPath = file_index_path(silverPath)
+    if not DeltaTable.isDeltaTable(spark, indexPath):
+        return silverDF
+    synced = _file_index_version(spark, indexPath)
+    if synced is None:
+        return silverDF
+
+    # log partition values are strings, so the index dates are compared as such
+    selected = {
+        row.file_name: row.p_eventdate and str(row.p_eventdate)
+        for row in spark.read.format("delta")
+        .load(indexPath)
+        .where(
+            (col("min_device_id") <= device_id)
+            & (col("max_device_id") >= device_id)
+            & (col("min_eventtime") <= lit(end))
+            & (col("max_eventtime") >= lit(start))
+        )
+        .select("file_name", "p_eventdate")
+        .collect()
+    }
+    version = _latest_version(spark, silverPath)
+    if version > synced:
+        try:
+            selected.update(_unindexed_files(spark, silverPath, synced + 1, version))
+        except AnalysisException:
+            # those log entries were cleaned up: scan on stats until the next sync
+            return silverDF
+    return _read_silver_files(
+        spark,
+        silverPath,
+        list(selected),
+        None if None in selected.values() else sorted(set(selected.values())),
+        silverDF,
+        device_id,
+    )
+
+
+def _unindexed_files(
+    spark: SparkSession, silverPath: str, start: int, end: int
+) -> dict:
+    """File name to p_eventdate of the files added by the commits start..end."""
+    return {
+        action.add.path.rsplit("/", 1)[-1]: (action.add.partitionValues or {}).get(
+            "p_eventdate"
+        )
+        for action in commit_range_actions(spark, silverPath, start, end)
+        .where("add IS NOT NULL")
+        .collect()
+    }
+
+
+def _latest_version(spark: SparkSession, path: str) -> int:
+    return DeltaTable.forPath(spark, path).history(1).first().version
+
+
+def _file_index_version(spark: SparkSession, indexPath: str) -> int:
+    properties = DeltaTable.forPath(spark, indexPath).detail().first().properties
+    version = (properties or {}).get(FILE_INDEX_VERSION_PROPERTY)
+    return None if version is None else int(version)
+
+
+def _set_file_index_version(spark: SparkSession, indexPath: str, version: int) -> None:
+    spark.sql(
+        f"ALTER TABLE delta.`{indexPath}` SET TBLPROPERTIES "
+        f"('{FILE_INDEX_VERSION_PROPERTY}' = '{version}')"
+    )
+
+
+def _silver_files(spark: SparkSession, silverPath: str, version: int) -> set:
+    """Names of the data files of one silver snapshot."""
+    return {
+        path.rsplit("/", 1)[-1]
+        for path in spark.read.format("delta")
+        .option("versionAsOf", version)
+        .load(silverPath)
+        .inputFiles()
+    }
+
+
+def _read_silver_files(
+    spark: SparkSession,
+    silverPath: str,
+    file_names: list,
+    event_dates: list = None,
+    silverDF: DataFrame = None,
+    device_id: int = None,
+) -> DataFrame:
+    """Silver rows stored in the given data files, read through Delta.
+
+    Delta cannot prune on the file name, so the scan is restricted to the
+    event_dates partitions of the files, and to the bucket of device_id on a
+    device_bucketed table; data skipping on the file stats does the rest.
+    """
+    if silverDF is None:
+        silverDF = spark.read.format("delta").load(silverPath)
+    if not file_names:
+        return silverDF.where(lit(False))
+    if event_dates is not None:
+        silverDF = silverDF.where(col("p_eventdate").isin(event_dates))
+    if device_id is not None:
+        buckets = silver_device_buckets(spark, silverPath)
+        if buckets is not None:
+            silverDF = silverDF.where(
+                col("p_device_bucket") == device_bucket(device_id, buckets)
+            )
+    return silverDF.where(col("_metadata.file_name").isin(list(file_names)))
+
+
+def _refresh_file_index(spark: SparkSession, silverPath: str) -> None:
+    """Index the files of the silver commit the caller just made.
+
+    The add and remove actions come from the Delta log entry of the latest
+    version, so the cost follows the commit rather than the table. When no
+    other commit came in between since the last sync, the synced version
+    moves on; otherwise read_device_range takes the files of the commits in
+    between from the log until the next update_file_index.
+    """
+    indexPath = file_index_path(silverPath)
+    if not DeltaTable.isDeltaTable(spark, indexPath):
+        return
+    version = _latest_version(spark, silverPath)
+    actions = commit_actions(spark, silverPath, version).collect()
+
+    removed = [
+        action.remove.path.rsplit("/", 1)[-1] for action in actions if action.remove
+    ]
+    if removed:
+        DeltaTable.forPath(spark, indexPath).delete(col("file_name").isin(removed))
+    added = [action.add for action in actions if action.add]
+    if added:
+        _index_silver_files(
+            spark,
+            silverPath,
+            [add.path.rsplit("/", 1)[-1] for add in added],
+            sorted(
+                {
+                    add.partitionValues["p_eventdate"]
+                    for add in added
+                    if "p_eventdate" in (add.partitionValues or {})
+                }
+            ),
+        )
+    if _file_index_version(spark, indexPath) == version - 1:
+        _set_file_index_version(spark, indexPath, version)
 
 
 # COMMAND ----------
 
-def update_silver_table(spark: SparkSession, silverPath: str) -> bool:
+@accepts_pipeline_config
+def replay_silver(
+    spark: SparkSession,
+    bronzePath: str,
+    silverPath: str,
+    start: date,
+    end: date,
+    by: str = "p_eventdate",
+    max_workers: int = 4,
+    interpolate: bool = True,
+    retries: int = 3,
+    initial_backoff: float = 1.0,
+    versioned: bool = None,
+) -> dict:
+    """Rebuild the silver partitions of a date range from bronze.
+
+    by="p_eventdate" replays the event dates start..end; by="p_ingestdate"
+    replays every event date that has readings ingested in start..end. Each
+    event date is rewritten by its own batch job with a replaceWhere on that
+    partition, max_workers at a time, so the live bronze -> silver stream and
+    its checkpoint are left alone; a job that loses a commit race with the
+    stream is retried after a jittered exponential backoff from
+    initial_backoff seconds, on a fresh read of bronze that includes what the
+    stream just appended. Streams reading silver need skipChangeCommits to
+    get past the rewrite. Bronze is parsed with transform_bronze(versioned),
+    which defaults to whether silver has a schema_version column. Returns the
+    rows written per event date.
+    """
+    if by not in ("p_eventdate", "p_ingestdate"):
+        raise ValueError(f"Unknown replay range column: {by}")
+    bronzeDF = spark.read.format("delta").load(bronzePath)
+    if versioned is None:
+        versioned = DeltaTable.isDeltaTable(spark, silverPath) and (
+            "schema_version" in spark.read.format("delta").load(silverPath).columns
+        )
+
+    if by == "p_ingestdate":
+        event_dates = [
+            row.p_eventdate
+            for row in transform_bronze(
+                bronzeDF.where(col("p_ingestdate").between(start, end)),
+                versioned=versioned,
+            )
+            .select("p_eventdate")
+            .distinct()
+            .collect()
+            if row.p_eventdate is not None
+        ]
+    else:
+        event_dates = [
+            start + timedelta(days=offset) for offset in range((end - start).days + 1)
+        ]
+    if not event_dates:
+        return {}
+
+    replayDF = _replay_readings(bronzeDF, event_dates, versioned).persist()
+    layout, buckets = _silver_table_layout(spark, silverPath)
+    layout = layout or "date"
+    try:
+        rows = {
+            row.p_eventdate: row["count"]
+            for row in replayDF.groupBy("p_eventdate").count().collect()
+        }
+
+        def replay(event_date: date) -> None:
+            dateDF = replayDF.where(col("p_eventdate") == event_date)
+            for attempt in range(retries + 1):
+                try:
+                    (
+                        apply_silver_layout(dateDF, layout, buckets)
+                        .write.format("delta")
+                        .mode("overwrite")
+                        .option("replaceWhere", f"p_eventdate = DATE'{event_date}'")
+                        .option("mergeSchema", versioned)
+                        .partitionBy(*SILVER_LAYOUTS[layout])
+                        .save(silverPath)
+                    )
+                    return
+                except ConcurrentAppendException:
+                    if attempt == retries:
+                        raise
+                    # full jitter keeps the workers from retrying in lockstep
+                    time.sleep(random.uniform(0, initial_backoff * 2**attempt))
+                    # the stream appended readings the persisted snapshot lacks;
+                    # overwriting with it would delete them again
+                    dateDF = _replay_readings(
+                        spark.read.format("delta").load(bronzePath),
+                        [event_date],
+                        versioned,
+                    )
+                    rows[event_date] = dateDF.count()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(replay, event_dates))
+    finally:
+        replayDF.unpersist()
+
+    if interpolate:
+        update_silver_table(spark, silverPath)
+    else:
+        _refresh_file_index(spark, silverPath)
+    return {str(event_date): rows.get(event_date, 0) for event_date in event_dates}
+
+
+def _replay_readings(
+    bronzeDF: DataFrame, event_dates: list, versioned: bool
+) -> DataFrame:
+    # a reading cannot be ingested before it happened
+    return transform_bronze(
+        bronzeDF.where(col("p_ingestdate") >= min(event_dates)), versioned=versioned
+    ).where(col("p_eventdate").isin(event_dates))
+
+
+# COMMAND ----------
+
+@accepts_pipeline_config
+def update_silver_table(
+    spark: SparkSession,
+    silverPath: str,
+    engine: str = "window",
+    max_gap_seconds: int = 24 * 3600,
+) -> bool:
+
+    silverDF = spark.read.format("delta").load(silverPath)
+    bucketed = "p_device_bucket" in silverDF.columns
+
+    brokenDF = silverDF.where(col("heartrate") < 0)
+    broken_dates = [
+        row.p_eventdate for row in brokenDF.select("p_eventdate").distinct().collect()
+    ]
+    if not broken_dates:
+        return True
+    if engine not in ("window", "pandas"):
+        raise ValueError(f"Unknown update_silver_table engine: {engine}")
+
+    # a device's previous/next valid reading may sit on a neighbouring day
+    reach = 1 if engine == "window" else -(-max_gap_seconds // 86400)
+    scan_dates = sorted(
+        {
+            date + timedelta(days=offset)
+            for date in broken_dates
+            for offset in range(-reach, reach + 1)
+        }
+    )
 
     update_match = """
+    health_tracker.p_eventdate IN ({})
+    AND
     health_tracker.eventtime = updates.eventtime
     AND
     health_tracker.device_id = updates.device_id
-  """
+  """.format(
+        ", ".join(f"DATE'{date}'" for date in broken_dates)
+    )
 
     update = {"heartrate": "updates.heartrate"}
 
-    dateWindow = Window.orderBy("p_eventdate")
+    scopedDF = silverDF.where(col("p_eventdate").isin(scan_dates))
 
-    interpolatedDF = spark.read.table("health_tracker_plus_silver").select(
-        "*",
-        lag(col("heartrate")).over(dateWindow).alias("prev_amt"),
-        lead(col("heartrate")).over(dateWindow).alias("next_amt"),
-    )
+    # a device lives in a single bucket, so only the broken buckets are scanned
+    # and rewritten
+    if bucketed:
+        broken_buckets = sorted(
+            row.p_device_bucket
+            for row in brokenDF.select("p_device_bucket").distinct().collect()
+        )
+        scopedDF = scopedDF.where(col("p_device_bucket").isin(broken_buckets))
+        update_match += "AND health_tracker.p_device_bucket IN ({})".format(
+            ", ".join(str(bucket) for bucket in broken_buckets)
+        )
 
-    updatesDF = interpolatedDF.where(col("heartrate") < 0).select(
-        "device_id",
-        ((col("prev_amt") + col("next_amt")) / 2).alias("heartrate"),
-        "eventtime",
-        "name",
-        "p_eventdate",
-    )
+    if engine == "pandas":
+        brokenDevicesDF = scopedDF.where(col("heartrate") < 0).select("device_id")
+        updatesDF = (
+            scopedDF.join(brokenDevicesDF.distinct(), "device_id", "left_semi")
+            .select("device_id", "eventtime", "p_eventdate", "heartrate")
+            .groupBy("device_id")
+            .applyInPandas(
+                interpolate_device_readings(max_gap_seconds),
+                "device_id INTEGER, eventtime TIMESTAMP, "
+                "p_eventdate DATE, heartrate DOUBLE",
+            )
+        )
+    else:
+        deviceWindow = Window.partitionBy("device_id").orderBy("eventtime")
+
+        interpolatedDF = scopedDF.select(
+            "*",
+            lag(col("heartrate")).over(deviceWindow).alias("prev_amt"),
+            lead(col("heartrate")).over(deviceWindow).alias("next_amt"),
+        )
+
+        updatesDF = interpolatedDF.where(col("heartrate") < 0).select(
+            "device_id",
+            ((col("prev_amt") + col("next_amt")) / 2).alias("heartrate"),
+            "eventtime",
+            "name",
+            "p_eventdate",
+        )
 
     silverTable = DeltaTable.forPath(spark, silverPath)
 
@@ -88,38 +1370,118 @@ def update_silver_table(spark: SparkSession, silverPath: str) -> bool:
         .whenMatchedUpdate(set=update)
         .execute()
     )
+    _refresh_file_index(spark, silverPath)
 
     return True
 
 
 # COMMAND ----------
 
-def transform_bronze(bronze: DataFrame) -> DataFrame:
+def transform_bronze(
+    bronze: DataFrame,
+    engine: str = "from_json",
+    versioned: bool = False,
+    keep_columns: tuple = (),
+) -> DataFrame:
+
+    # bronze written by transform_raw(parsed=True) is already typed; selecting
+    # the narrow columns means value is neither read nor parsed again
+    if not versioned and set(PARSED_BRONZE_COLUMNS) <= set(bronze.columns):
+        return bronze.select(*PARSED_BRONZE_COLUMNS, *keep_columns)
 
     json_schema = "device_id INTEGER, heartrate DOUBLE, name STRING, time FLOAT"
+    columns = ["device_id", "heartrate", "eventtime", "name", "p_eventdate"]
+    passthrough = tuple(keep_columns)
 
-    return (
-        bronze.select(from_json(col("value"), json_schema).alias("nested_json"))
-        .select("nested_json.*")
-        .select(
-            "device_id",
-            "heartrate",
-            from_unixtime("time").cast("timestamp").alias("eventtime"),
-            "name",
-            from_unixtime("time").cast("date").alias("p_eventdate"),
+    if versioned:
+        # one pass with the union of every registered schema; fields added by
+        # later versions and the detected version land after the v1 columns
+        # the same way mergeSchema appends them to silver
+        fields = union_schema_fields()
+        json_schema = ", ".join(f"{name} {data_type}" for name, data_type in fields)
+        columns += [name for name, _ in fields if name not in columns + ["time"]]
+    parsed_columns = columns + list(keep_columns)
+
+    if engine == "arrow":
+        parsedDF = transform_bronze_arrow(
+            bronze, json_schema, parsed_columns, passthrough
         )
-    )
+    elif engine == "from_json":
+        derived = {
+            "eventtime": from_unixtime("time").cast("timestamp").alias("eventtime"),
+            "p_eventdate": from_unixtime("time").cast("date").alias("p_eventdate"),
+        }
+        parsedDF = (
+            bronze.select(
+                from_json(col("value"), json_schema).alias("nested_json"), *passthrough
+            )
+            .select("nested_json.*", *passthrough)
+            .select(*[derived.get(column, column) for column in parsed_columns])
+        )
+    else:
+        raise ValueError(f"Unknown transform_bronze engine: {engine}")
+
+    if not versioned:
+        return parsedDF
+    return parsedDF.select(*columns, schema_version_column(), *keep_columns)
+
 
+# COMMAND ----------
+
+def transform_bronze_validated(bronze: DataFrame, versioned: bool = False) -> DataFrame:
+    """transform_bronze plus the raw value, p_ingestdate and a parse_error column.
+
+    parse_error is null for good records, otherwise it names the problem:
+    malformed JSON, or each v1 field that is missing or has the wrong type.
+    """
+    validatedDF = transform_bronze(
+        bronze.withColumn("json_keys", expr("json_object_keys(value)")),
+        versioned=versioned,
+        keep_columns=("value", "p_ingestdate", "json_keys"),
+    )
+    parsed_columns = {"time": "eventtime"}
+    field_errors = ", ".join(
+        f"""CASE
+            WHEN NOT array_contains(json_keys, '{name}') THEN 'missing {name}'
+            WHEN {parsed_columns.get(name, name)} IS NULL THEN 'invalid {name}'
+        END"""
+        for name, _ in schema_fields(HEALTH_TRACKER_SCHEMAS[1])
+    )
+    parse_error = f"""
+        CASE
+            WHEN json_keys IS NULL THEN 'malformed json'
+            ELSE nullif(concat_ws('; ', {field_errors}), '')
+        END
+    """
+    return validatedDF.withColumn("parse_error", expr(parse_error)).drop("json_keys")
 
 # COMMAND ----------
 
-def transform_raw(df: DataFrame) -> DataFrame:
-    return df.select(
+# typed columns a parsed bronze table stores next to the raw value
+PARSED_BRONZE_COLUMNS = ["device_id", "heartrate", "eventtime", "name", "p_eventdate"]
+
+# codec for parsed bronze files; the raw value is only kept for audit, so it is
+# stored as densely as possible and never read by silver rebuilds
+BRONZE_PAYLOAD_COMPRESSION = "zstd"
+
+
+def transform_raw(
+    df: DataFrame, with_hash: bool = False, parsed: bool = False
+) -> DataFrame:
+    columns = [
         lit("files.training.databricks.com").alias("datasource"),
         current_timestamp().alias("ingesttime"),
         "value",
-        current_timestamp().cast("date").alias("p_ingestdate"),
-    )
+    ]
+    if with_hash:
+        columns += [
+            xxhash64(col("value")).alias("value_hash"),
+            length(col("value")).alias("value_length"),
+        ]
+    if parsed:
+        df = transform_bronze(df, keep_columns=("value",))
+        columns += PARSED_BRONZE_COLUMNS
+    return df.select(*columns, current_timestamp().cast("date").alias("p_ingestdate"))
 
 
 # COMMAND ----------
@@ -134,11 +1496,369 @@ def transform_silver_mean_agg(silver: DataFrame) -> DataFrame:
 
 # COMMAND ----------
 
-def transform_silver_mean_agg_last_thirty(silver: DataFrame) -> DataFrame:
-    health_tracker_gold_aggregate_heartrate = spark.read.table(
-        "health_tracker_gold_aggregate_heartrate"
+# Chan et al. parallel combination of (count, mean, M2) for two disjoint sets
+HEARTRATE_STATE_MERGE = {
+    "count_heartrate": "state.count_heartrate + updates.count_heartrate",
+    "mean_heartrate": """
+        state.mean_heartrate
+        + (updates.mean_heartrate - state.mean_heartrate)
+        * updates.count_heartrate
+        / (state.count_heartrate + updates.count_heartrate)
+    """,
+    "m2_heartrate": """
+        state.m2_heartrate
+        + updates.m2_heartrate
+        + pow(updates.mean_heartrate - state.mean_heartrate, 2)
+        * state.count_heartrate
+        * updates.count_heartrate
+        / (state.count_heartrate + updates.count_heartrate)
+    """,
+    "max_heartrate": "greatest(state.max_heartrate, updates.max_heartrate)",
+}
+
+
+def transform_silver_partial_agg(silver: DataFrame) -> DataFrame:
+    return (
+        silver.where(col("heartrate").isNotNull())
+        .groupBy("device_id")
+        .agg(
+            count(col("heartrate")).alias("count_heartrate"),
+            mean(col("heartrate")).alias("mean_heartrate"),
+            (var_pop(col("heartrate")) * count(col("heartrate"))).alias("m2_heartrate"),
+            max(col("heartrate")).alias("max_heartrate"),
+        )
+    )
+
+
+def transform_gold_state(state: DataFrame) -> DataFrame:
+    return state.select(
+        "device_id",
+        "mean_heartrate",
+        when(
+            col("count_heartrate") > 1,
+            sqrt(col("m2_heartrate") / (col("count_heartrate") - 1)),
+        ).alias("std_heartrate"),
+        "max_heartrate",
+    )
+
+
+# COMMAND ----------
+
+def transform_silver_rolling_agg(
+    silver: DataFrame, window_days: int = 30, watermark: str = "1 day"
+) -> DataFrame:
+    """Per-device heart-rate aggregates over window_days windows sliding daily.
+
+    Windows are aligned to UTC midnight and labelled by the date they end on
+    (exclusive), so each new reading only updates the windows that contain it.
+    """
+    return (
+        silver.withWatermark("eventtime", watermark)
+        .groupBy("device_id", window("eventtime", f"{window_days} days", "1 day"))
+        .agg(
+            count(col("heartrate")).alias("count_heartrate"),
+            mean(col("heartrate")).alias("mean_heartrate"),
+            stddev(col("heartrate")).alias("std_heartrate"),
+            max(col("heartrate")).alias("max_heartrate"),
+        )
+        .select(
+            "device_id",
+            lit(window_days).alias("window_days"),
+            _utc_date("window.start").alias("window_start"),
+            _utc_date("window.end").alias("window_end"),
+            "count_heartrate",
+            "mean_heartrate",
+            "std_heartrate",
+            "max_heartrate",
+        )
+    )
+
+
+def _utc_date(column: str) -> Column:
+    # window boundaries are UTC midnights; a plain cast to date would take the
+    # calendar date in the session time zone instead
+    return expr(f"to_date(to_utc_timestamp({column}, current_timezone()))")
+
+
+# COMMAND ----------
+
+def lookup_rolling_gold(
+    rollingGold: DataFrame, anchor_date: str, window_days: int = 30
+) -> DataFrame:
+    """Per-device window_days aggregates for the days up to and including anchor_date."""
+    return rollingGold.where(
+        (col("window_days") == window_days)
+        & (col("window_end") == expr(f"date_add(cast('{anchor_date}' AS DATE), 1)"))
+    )
+
+
+# COMMAND ----------
+
+EWMA_STATE_SCHEMA = "ewma_heartrate DOUBLE, readings BIGINT"
+
+EWMA_OUTPUT_SCHEMA = (
+    "device_id INTEGER, eventtime TIMESTAMP, heartrate DOUBLE, "
+    "ewma_heartrate DOUBLE, p_eventdate DATE"
+)
+
+
+def transform_silver_ewma(silver: DataFrame, alpha: float = 0.1) -> DataFrame:
+    """Add each device's exponentially weighted moving average of heartrate.
+
+    The average is carried between micro-batches in the streaming state store,
+    one row per device, so a batch only touches the devices it contains.
+    Negative (broken) readings are left out.
+    """
+    return (
+        silver.where(col("heartrate") >= 0)
+        .select("device_id", "eventtime", "heartrate", "p_eventdate")
+        .groupBy("device_id")
+        .applyInPandasWithState(
+            _update_device_ewma(alpha),
+            EWMA_OUTPUT_SCHEMA,
+            EWMA_STATE_SCHEMA,
+            "append",
+            GroupStateTimeout.NoTimeout,
+        )
+    )
+
+
+def _update_device_ewma(alpha: float):
+    def update(key, readings, state):
+        import numpy as np
+
+        ewma, count = state.get if state.exists else (None, 0)
+        for batch in readings:
+            batch = batch.sort_values("eventtime", kind="mergesort")
+            heartrate = batch["heartrate"].to_numpy(dtype="float64")
+            averages = np.empty_like(heartrate)
+            for index, value in enumerate(heartrate):
+                ewma = value if ewma is None else alpha * value + (1 - alpha) * ewma
+                averages[index] = ewma
+            count += len(heartrate)
+            yield batch.assign(ewma_heartrate=averages)[
+                ["device_id", "eventtime", "heartrate", "ewma_heartrate", "p_eventdate"]
+            ]
+        if ewma is not None:
+            state.update((float(ewma), int(count)))
+
+    return update
+
+
+def flag_anomalies(
+    readings: DataFrame,
+    baseline: DataFrame,
+    threshold: float = 3.0,
+    ewma_threshold: float = 2.0,
+) -> DataFrame:
+    """Readings far from the device's gold mean, alone or as a sustained drift.
+
+    A reading is flagged as a spike when it is more than threshold gold
+    standard deviations from the gold mean, and as a drift when its EWMA is
+    more than ewma_threshold deviations away. baseline holds device_id,
+    mean_heartrate and std_heartrate; devices without a baseline are skipped.
+    """
+    scored = readings.join(broadcast(baseline), "device_id").select(
+        "device_id",
+        "eventtime",
+        "heartrate",
+        "ewma_heartrate",
+        "mean_heartrate",
+        "std_heartrate",
+        ((col("heartrate") - col("mean_heartrate")) / col("std_heartrate")).alias(
+            "zscore"
+        ),
+        (
+            (col("ewma_heartrate") - col("mean_heartrate")) / col("std_heartrate")
+        ).alias("ewma_zscore"),
+        "p_eventdate",
+    )
+    reason = (
+        when(abs(col("zscore")) > threshold, lit("spike"))
+        .when(abs(col("ewma_zscore")) > ewma_threshold, lit("drift"))
+    )
+    return (
+        scored.where(col("std_heartrate") > 0)
+        .withColumn("reason", reason)
+        .where(col("reason").isNotNull())
+    )
+
+
+class GoldBaseline:
+    """Cached per-device gold mean/stddev, reloaded every refresh_seconds.
+
+    Every micro-batch joins against the same in-memory copy, broadcast to the
+    executors, instead of reading the gold table again.
+    """
+
+    def __init__(self, goldPath: str, refresh_seconds: float = 3600.0):
+        self.goldPath = goldPath
+        self.refresh_seconds = refresh_seconds
+        self._baseline = None
+        self._loaded_at = None
+
+    def get(self, spark: SparkSession) -> DataFrame:
+        now = time.monotonic()
+        if self._baseline is None or now - self._loaded_at >= self.refresh_seconds:
+            baseline = (
+                spark.read.format("delta")
+                .load(self.goldPath)
+                .select("device_id", "mean_heartrate", "std_heartrate")
+                .cache()
+            )
+            baseline.count()
+            previous, self._baseline, self._loaded_at = self._baseline, baseline, now
+            if previous is not None:
+                previous.unpersist()
+        return self._baseline
+
+
+# COMMAND ----------
+
+# names of the queries built by the stream writers in this module, and the
+# writers themselves for a StreamSupervisor to start and restart
+TRACKED_STREAMS = set()
+STREAM_WRITERS = {}
+
+
+def _track_stream(name: str, stream_writer: DataStreamWriter) -> None:
+    TRACKED_STREAMS.add(name)
+    STREAM_WRITERS[name] = stream_writer
+
+
+STREAM_METRICS_SCHEMA = """
+    query_name STRING,
+    run_id STRING,
+    batch_id BIGINT,
+    timestamp TIMESTAMP,
+    num_input_rows BIGINT,
+    input_rows_per_second DOUBLE,
+    processed_rows_per_second DOUBLE,
+    trigger_execution_ms BIGINT,
+    duration_ms MAP<STRING, BIGINT>,
+    state_rows_total BIGINT,
+    state_memory_bytes BIGINT
+"""
+
+
+class StreamMetricsListener(StreamingQueryListener):
+    """Buffers the progress of tracked queries and appends it to a Delta table.
+
+    The listener callback only buffers; a driver thread writes the buffer every
+    flush_seconds, or sooner once flush_rows events are waiting. Only queries
+    whose name starts with name_prefix are recorded.
+    """
+
+    def __init__(
+        self,
+        spark: SparkSession,
+        metricsPath: str,
+        flush_rows: int = 100,
+        flush_seconds: float = 30.0,
+        name_prefix: str = "",
+    ):
+        self._spark = spark
+        self._metricsPath = metricsPath
+        self._name_prefix = name_prefix
+        self._flush_rows = flush_rows
+        self._flush_seconds = flush_seconds
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        threading.Thread(
+            target=self._run, name="stream-metrics-flush", daemon=True
+        ).start()
+
+    def onQueryStarted(self, event) -> None:
+        pass
+
+    def onQueryProgress(self, event) -> None:
+        progress = json.loads(event.progress.json)
+        name = progress["name"]
+        if name not in TRACKED_STREAMS or not name.startswith(self._name_prefix):
+            return
+        with self._lock:
+            self._buffer.append(_stream_metrics_row(progress))
+            if len(self._buffer) >= self._flush_rows:
+                self._wake.set()
+
+    def onQueryIdle(self, event) -> None:
+        pass
+
+    def onQueryTerminated(self, event) -> None:
+        self._wake.set()
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if rows:
+            (
+                self._spark.createDataFrame(rows, STREAM_METRICS_SCHEMA)
+                .write.format("delta")
+                .mode("append")
+                .save(self._metricsPath)
+            )
+        return len(rows)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self._flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as error:
+                print(f"Unable to write stream metrics: {error!r}")
+
+
+def _stream_metrics_row(progress: dict) -> tuple:
+    durations = progress.get("durationMs") or {}
+    state_operators = progress.get("stateOperators") or []
+    return (
+        progress["name"],
+        progress["runId"],
+        progress["batchId"],
+        datetime.strptime(progress["timestamp"], "%Y-%m-%dT%H:%M:%S.%fZ"),
+        progress.get("numInputRows"),
+        progress.get("inputRowsPerSecond"),
+        progress.get("processedRowsPerSecond"),
+        durations.get("triggerExecution"),
+        durations,
+        sum(operator.get("numRowsTotal", 0) for operator in state_operators),
+        sum(operator.get("memoryUsedBytes", 0) for operator in state_operators),
     )
-    return silver.join(
-        spark.read.table("health_tracker_gold_aggregate_heartrate"), "device_id"
-    ).where("p_eventdate > cast('2020-03-01' AS DATE) - 30")
 
+
+_STREAM_METRICS = {}
+
+
+@accepts_pipeline_config
+def enable_stream_metrics(
+    spark: SparkSession, metricsPath: str, name_prefix: str = "", **flush_options
+) -> StreamMetricsListener:
+    """Register the metrics listener once per Spark session and metrics table."""
+    key = (id(spark), metricsPath)
+    if key not in _STREAM_METRICS:
+        _STREAM_METRICS[key] = StreamMetricsListener(
+            spark, metricsPath, name_prefix=name_prefix, **flush_options
+        )
+        spark.streams.addListener(_STREAM_METRICS[key])
+    return _STREAM_METRICS[key]
+
+
+# COMMAND ----------
+
+@accepts_pipeline_config
+def stream_latency_percentiles(spark: SparkSession, metricsPath: str) -> DataFrame:
+    """p50/p95 batch latency and throughput per query, over batches that read data."""
+    return (
+        spark.read.format("delta")
+        .load(metricsPath)
+        .where(col("num_input_rows") > 0)
+        .groupBy("query_name")
+        .agg(
+            count("*").alias("batches"),
+            expr("percentile_approx(trigger_execution_ms, 0.5)").alias("p50_batch_ms"),
+            expr("percentile_approx(trigger_execution_ms, 0.95)").alias("p95_batch_ms"),
+            mean(col("processed_rows_per_second")).alias("mean_rows_per_second"),
+        )
+    )
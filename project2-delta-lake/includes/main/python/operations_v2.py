@@ -1,5 +1,7 @@
 # Databricks notebook source
 
+from datetime import timedelta
+
 from delta.tables import DeltaTable
 from pyspark.sql import DataFrame
 from pyspark.sql.functions import (
@@ -9,15 +11,22 @@ from pyspark.sql.functions import (
     from_unixtime,
     lag,
     lead,
+    length,
     lit,
     mean,
     stddev,
     max,
+    xxhash64,
 )
 from pyspark.sql.session import SparkSession
 from pyspark.sql.streaming import DataStreamWriter
 from pyspark.sql.window import Window
 
+from main.python.arrow_engine import transform_bronze_arrow
+from main.python.interpolation import interpolate_device_readings
+from main.python.schema_registry import schema_version_column, union_schema_fields
+from main.python.stream_profiles import apply_trigger, rate_limit_options
+
 # COMMAND ----------
 
 def create_stream_writer(
@@ -27,6 +36,8 @@ def create_stream_writer(
     partition_column: str,
     mode: str = "append",
     mergeSchema: bool = False,
+    trigger: dict = None,
+    profile: str = None,
 ) -> DataStreamWriter:
 
     stream_writer = (
@@ -37,6 +48,7 @@ def create_stream_writer(
         .queryName(name)
     )
 
+    stream_writer = apply_trigger(stream_writer, trigger, profile)
     if mergeSchema:
         stream_writer = stream_writer.option("mergeSchema", True)
     if partition_column is not None:
@@ -46,44 +58,116 @@ def create_stream_writer(
 
 # COMMAND ----------
 
-def read_stream_delta(spark: SparkSession, deltaPath: str) -> DataFrame:
-    return spark.readStream.format("delta").load(deltaPath)
+def read_stream_delta(
+    spark: SparkSession,
+    deltaPath: str,
+    profile: str = None,
+    maxFilesPerTrigger: int = None,
+    maxBytesPerTrigger: str = None,
+) -> DataFrame:
+    options = rate_limit_options(
+        profile,
+        maxFilesPerTrigger=maxFilesPerTrigger,
+        maxBytesPerTrigger=maxBytesPerTrigger,
+    )
+    return spark.readStream.format("delta").options(**options).load(deltaPath)
 
 
 # COMMAND ----------
 
-def read_stream_raw(spark: SparkSession, rawPath: str) -> DataFrame:
+def read_stream_raw(
+    spark: SparkSession,
+    rawPath: str,
+    profile: str = None,
+    maxFilesPerTrigger: int = None,
+) -> DataFrame:
+    # the text file source only supports a file-count limit, not maxBytesPerTrigger
     kafka_schema = "value STRING"
-    return spark.readStream.format("text").schema(kafka_schema).load(rawPath)
+    options = rate_limit_options(profile, maxFilesPerTrigger=maxFilesPerTrigger)
+    options.pop("maxBytesPerTrigger", None)
+    return (
+        spark.readStream.format("text")
+        .schema(kafka_schema)
+        .options(**options)
+        .load(rawPath)
+    )
 
 
 # COMMAND ----------
 
-def update_silver_table(spark: SparkSession, silverPath: str) -> bool:
+def update_silver_table(
+    spark: SparkSession,
+    silverPath: str,
+    engine: str = "window",
+    max_gap_seconds: int = 24 * 3600,
+) -> bool:
+
+    silverDF = spark.read.format("delta").load(silverPath)
+
+    broken_dates = [
+        row.p_eventdate
+        for row in silverDF.where(col("heartrate") < 0)
+        .select("p_eventdate")
+        .distinct()
+        .collect()
+    ]
+    if not broken_dates:
+        return True
+    if engine not in ("window", "pandas"):
+        raise ValueError(f"Unknown update_silver_table engine: {engine}")
+
+    # a device's previous/next valid reading may sit on a neighbouring day
+    reach = 1 if engine == "window" else -(-max_gap_seconds // 86400)
+    scan_dates = sorted(
+        {
+            date + timedelta(days=offset)
+            for date in broken_dates
+            for offset in range(-reach, reach + 1)
+        }
+    )
 
     update_match = """
+    health_tracker.p_eventdate IN ({})
+    AND
     health_tracker.eventtime = updates.eventtime
     AND
     health_tracker.device_id = updates.device_id
-  """
+  """.format(
+        ", ".join(f"DATE'{date}'" for date in broken_dates)
+    )
 
     update = {"heartrate": "updates.heartrate"}
 
-    dateWindow = Window.orderBy("p_eventdate")
+    scopedDF = silverDF.where(col("p_eventdate").isin(scan_dates))
+
+    if engine == "pandas":
+        brokenDevicesDF = scopedDF.where(col("heartrate") < 0).select("device_id")
+        updatesDF = (
+            scopedDF.join(brokenDevicesDF.distinct(), "device_id", "left_semi")
+            .select("device_id", "eventtime", "p_eventdate", "heartrate")
+            .groupBy("device_id")
+            .applyInPandas(
+                interpolate_device_readings(max_gap_seconds),
+                "device_id INTEGER, eventtime TIMESTAMP, "
+                "p_eventdate DATE, heartrate DOUBLE",
+            )
+        )
+    else:
+        deviceWindow = Window.partitionBy("device_id").orderBy("eventtime")
 
-    interpolatedDF = spark.read.table("health_tracker_plus_silver").select(
-        "*",
-        lag(col("heartrate")).over(dateWindow).alias("prev_amt"),
-        lead(col("heartrate")).over(dateWindow).alias("next_amt"),
-    )
+        interpolatedDF = scopedDF.select(
+            "*",
+            lag(col("heartrate")).over(deviceWindow).alias("prev_amt"),
+            lead(col("heartrate")).over(deviceWindow).alias("next_amt"),
+        )
 
-    updatesDF = interpolatedDF.where(col("heartrate") < 0).select(
-        "device_id",
-        ((col("prev_amt") + col("next_amt")) / 2).alias("heartrate"),
-        "eventtime",
-        "name",
-        "p_eventdate",
-    )
+        updatesDF = interpolatedDF.where(col("heartrate") < 0).select(
+            "device_id",
+            ((col("prev_amt") + col("next_amt")) / 2).alias("heartrate"),
+            "eventtime",
+            "name",
+            "p_eventdate",
+        )
 
     silverTable = DeltaTable.forPath(spark, silverPath)
 
@@ -99,33 +183,61 @@ def update_silver_table(spark: SparkSession, silverPath: str) -> bool:
 
 # COMMAND ----------
 
-def transform_bronze(bronze: DataFrame) -> DataFrame:
+def transform_bronze(
+    bronze: DataFrame, engine: str = "from_json", versioned: bool = False
+) -> DataFrame:
 
     json_schema = "device_id INTEGER, heartrate DOUBLE, device_type STRING, name STRING, time FLOAT"
-
-    return (
-        bronze.select(from_json(col("value"), json_schema).alias("nested_json"))
-        .select("nested_json.*")
-        .select(
-            "device_id",
-            "device_type",
-            "heartrate",
-            from_unixtime("time").cast("timestamp").alias("eventtime"),
-            "name",
-            from_unixtime("time").cast("date").alias("p_eventdate"),
+    columns = [
+        "device_id",
+        "device_type",
+        "heartrate",
+        "eventtime",
+        "name",
+        "p_eventdate",
+    ]
+
+    if versioned:
+        # parse with the union of every registered schema and label each record
+        # with the newest version it matches, as in operations.transform_bronze
+        fields = union_schema_fields()
+        json_schema = ", ".join(f"{name} {data_type}" for name, data_type in fields)
+        columns += [name for name, _ in fields if name not in columns + ["time"]]
+
+    if engine == "arrow":
+        parsedDF = transform_bronze_arrow(bronze, json_schema, columns)
+    elif engine == "from_json":
+        derived = {
+            "eventtime": from_unixtime("time").cast("timestamp").alias("eventtime"),
+            "p_eventdate": from_unixtime("time").cast("date").alias("p_eventdate"),
+        }
+        parsedDF = (
+            bronze.select(from_json(col("value"), json_schema).alias("nested_json"))
+            .select("nested_json.*")
+            .select(*[derived.get(column, column) for column in columns])
         )
-    )
+    else:
+        raise ValueError(f"Unknown transform_bronze engine: {engine}")
+
+    if not versioned:
+        return parsedDF
+    return parsedDF.select(*columns, schema_version_column())
 
 
 # COMMAND ----------
 
-def transform_raw(raw: DataFrame) -> DataFrame:
-    return raw.select(
+def transform_raw(raw: DataFrame, with_hash: bool = False) -> DataFrame:
+    columns = [
         lit("files.training.databricks.com").alias("datasource"),
         current_timestamp().alias("ingesttime"),
         "value",
-        current_timestamp().cast("date").alias("p_ingestdate"),
-    )
+    ]
+    if with_hash:
+        columns += [
+            xxhash64(col("value")).alias("value_hash"),
+            length(col("value")).alias("value_length"),
+        ]
+    return raw.select(*columns, current_timestamp().cast("date").alias("p_ingestdate"))
 
 
 # COMMAND ----------
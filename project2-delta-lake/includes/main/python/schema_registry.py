@@ -0,0 +1,90 @@
+# Databricks notebook source
+# MAGIC
+# MAGIC %md
+# MAGIC # Schema Registry
+# MAGIC
+# MAGIC Versions of the health-tracker JSON schema, used by
+# MAGIC `transform_bronze(versioned=True)` of operations and operations_v2.
+
+# COMMAND ----------
+
+import functools
+
+from pyspark.sql import Column
+from pyspark.sql.functions import expr
+from pyspark.sql.session import SparkSession
+
+from main.python.arrow_engine import ddl_schema
+
+# COMMAND ----------
+
+HEALTH_TRACKER_SCHEMAS = {
+    1: "device_id INTEGER, heartrate DOUBLE, name STRING, time FLOAT",
+    2: "device_id INTEGER, heartrate DOUBLE, device_type STRING, name STRING, time FLOAT",
+}
+
+
+def register_schema(version: int, json_schema: str) -> None:
+    """Add a health-tracker JSON schema version used by transform_bronze(versioned=True).
+
+    A registered version is immutable, and a field may not change type between
+    versions, so the union of all versions stays a valid parse schema.
+    """
+    existing = HEALTH_TRACKER_SCHEMAS.get(version)
+    if existing is not None and existing != json_schema:
+        raise ValueError(f"Schema version {version} is already registered")
+    HEALTH_TRACKER_SCHEMAS[version] = json_schema
+    try:
+        union_schema_fields()
+    except ValueError:
+        if existing is None:
+            del HEALTH_TRACKER_SCHEMAS[version]
+        raise
+
+
+@functools.lru_cache(maxsize=None)
+def schema_fields(json_schema: str) -> tuple:
+    """(name, type) of each field of a DDL schema, as parsed by Spark."""
+    schema = ddl_schema(SparkSession.getActiveSession(), json_schema)
+    return tuple(
+        (name, schema[name].dataType.simpleString()) for name in schema.names
+    )
+
+
+def union_schema_fields() -> list:
+    fields = {}
+    for version in sorted(HEALTH_TRACKER_SCHEMAS):
+        for name, data_type in schema_fields(HEALTH_TRACKER_SCHEMAS[version]):
+            if fields.setdefault(name, data_type) != data_type:
+                raise ValueError(
+                    f"Field {name} changes type in schema version {version}"
+                )
+    return list(fields.items())
+
+
+# COMMAND ----------
+
+def schema_version_column() -> Column:
+    """Newest registered version whose own fields are all set in the parsed record.
+
+    A version is told apart by the fields it introduced, checked on the columns
+    transform_bronze has already parsed (time as eventtime), so the JSON is not
+    read a second time.
+    """
+    parsed_columns = {"time": "eventtime"}
+    introduced, seen = {}, set()
+    for version, json_schema in sorted(HEALTH_TRACKER_SCHEMAS.items()):
+        names = [name for name, _ in schema_fields(json_schema) if name not in seen]
+        seen.update(names)
+        if names:
+            introduced[version] = names
+    cases = " ".join(
+        "WHEN {} THEN {}".format(
+            " AND ".join(
+                f"{parsed_columns.get(name, name)} IS NOT NULL" for name in names
+            ),
+            version,
+        )
+        for version, names in sorted(introduced.items(), reverse=True)
+    )
+    return expr(f"CASE {cases} END").alias("schema_version")
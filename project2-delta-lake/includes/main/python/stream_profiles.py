@@ -0,0 +1,62 @@
+# Databricks notebook source
+# MAGIC
+# MAGIC %md
+# MAGIC # Stream Profiles
+# MAGIC
+# MAGIC Named trigger and rate-limit presets of the stream readers and writers of
+# MAGIC operations and operations_v2.
+
+# COMMAND ----------
+
+from pyspark.sql.streaming import DataStreamWriter
+
+# COMMAND ----------
+
+STREAM_PROFILES = {
+    "backfill": {
+        "trigger": {"availableNow": True},
+        "maxFilesPerTrigger": 1000,
+        "maxBytesPerTrigger": "10g",
+    },
+    "low-latency": {
+        "trigger": {"processingTime": "1 second"},
+        "maxFilesPerTrigger": 10,
+        "maxBytesPerTrigger": "64m",
+    },
+    "steady": {
+        "trigger": {"processingTime": "30 seconds"},
+        "maxFilesPerTrigger": 100,
+        "maxBytesPerTrigger": "1g",
+    },
+}
+
+
+def stream_profile(profile: str) -> dict:
+    if profile is None:
+        return {}
+    if profile not in STREAM_PROFILES:
+        raise ValueError(
+            f"Unknown stream profile {profile!r}, expected one of {list(STREAM_PROFILES)}"
+        )
+    return STREAM_PROFILES[profile]
+
+
+def rate_limit_options(profile: str, **overrides) -> dict:
+    options = {
+        option: value
+        for option, value in stream_profile(profile).items()
+        if option != "trigger"
+    }
+    options.update(
+        {option: value for option, value in overrides.items() if value is not None}
+    )
+    return {option: str(value) for option, value in options.items()}
+
+
+def apply_trigger(
+    stream_writer: DataStreamWriter, trigger: dict, profile: str
+) -> DataStreamWriter:
+    trigger = trigger or stream_profile(profile).get("trigger")
+    if trigger is not None:
+        return stream_writer.trigger(**trigger)
+    return stream_writer
@@ -0,0 +1,105 @@
+# Databricks notebook source
+
+import re
+from dataclasses import dataclass
+
+# COMMAND ----------
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """Paths, checkpoints, stream, database and table names of one tenant.
+
+    Every location is derived from the tenant id, so any number of pipelines
+    can share one Spark application without touching each other's tables,
+    checkpoints or streams. Attribute names match the parameter names of the
+    functions in operations and utilities, which take config=PipelineConfig
+    in place of those arguments.
+    """
+
+    tenant: str
+    root: str = "/dbacademy/{tenant}/dataengineering/plus/"
+    database_prefix: str = "dbacademy_"
+
+    def __post_init__(self):
+        if not self.tenant or not re.fullmatch(r"[\w.@+-]+", self.tenant):
+            raise ValueError(f"Invalid tenant id: {self.tenant!r}")
+
+    @property
+    def key(self) -> str:
+        """The tenant id reduced to characters valid in names and identifiers."""
+        return re.sub(r"\W", "_", self.tenant).lower()
+
+    @property
+    def plusPipelinePath(self) -> str:
+        return self.root.format(tenant=self.tenant)
+
+    @property
+    def rawPath(self) -> str:
+        return self.plusPipelinePath + "raw/"
+
+    @property
+    def bronzePath(self) -> str:
+        return self.plusPipelinePath + "bronze/"
+
+    @property
+    def silverPath(self) -> str:
+        return self.plusPipelinePath + "silver/"
+
+    @property
+    def goldPath(self) -> str:
+        return self.plusPipelinePath + "gold/"
+
+    @property
+    def statePath(self) -> str:
+        return self.plusPipelinePath + "gold_state/"
+
+    @property
+    def quarantinePath(self) -> str:
+        return self.plusPipelinePath + "quarantine/"
+
+    @property
+    def alertsPath(self) -> str:
+        return self.plusPipelinePath + "alerts/"
+
+    @property
+    def metricsPath(self) -> str:
+        return self.plusPipelinePath + "stream_metrics/"
+
+    @property
+    def checkpointPath(self) -> str:
+        return self.plusPipelinePath + "checkpoints/"
+
+    @property
+    def bronzeCheckpoint(self) -> str:
+        return self.checkpointPath + "bronze/"
+
+    @property
+    def silverCheckpoint(self) -> str:
+        return self.checkpointPath + "silver/"
+
+    @property
+    def goldCheckpoint(self) -> str:
+        return self.checkpointPath + "gold/"
+
+    @property
+    def database(self) -> str:
+        return self.database_prefix + self.key
+
+    @property
+    def name_prefix(self) -> str:
+        return f"{self.key}__"
+
+    def stream_name(self, name: str) -> str:
+        """Query name scoped to the tenant; already scoped names are kept."""
+        if name.startswith(self.name_prefix):
+            return name
+        return self.name_prefix + name
+
+    def checkpoint(self, name: str) -> str:
+        """Checkpoint location of the tenant's query called name."""
+        if name.startswith(self.name_prefix):
+            name = name[len(self.name_prefix) :]
+        return self.checkpointPath + name + "/"
+
+    def table(self, name: str) -> str:
+        return f"{self.database}.{name}"
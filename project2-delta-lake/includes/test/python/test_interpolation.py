@@ -0,0 +1,52 @@
+# Databricks notebook source
+# MAGIC
+# MAGIC %md
+# MAGIC # Unit Tests for Interpolation
+
+# COMMAND ----------
+
+import pandas as pd
+import pytest
+
+from main.python.interpolation import interpolate_device_readings
+
+# COMMAND ----------
+
+def readings(*rows):
+    return pd.DataFrame(
+        [
+            (0, pd.Timestamp("2020-01-01") + pd.Timedelta(hours=hour), heartrate)
+            for hour, heartrate in rows
+        ],
+        columns=["device_id", "eventtime", "heartrate"],
+    )
+
+
+# COMMAND ----------
+
+def test_interpolate_time_weighted_run():
+    interpolate = interpolate_device_readings(max_gap_seconds=6 * 3600)
+    # out of order on purpose: readings are sorted by eventtime first
+    changed = interpolate(readings((3, 80.0), (0, 50.0), (1, -1.0), (2, -1.0)))
+
+    assert changed["eventtime"].dt.hour.tolist() == [1, 2]
+    assert changed["heartrate"].tolist() == pytest.approx([60.0, 70.0])
+
+
+def test_interpolate_gap_threshold():
+    broken = readings((0, 50.0), (1, -1.0), (4, 80.0))
+
+    assert interpolate_device_readings(4 * 3600)(broken)["heartrate"].tolist() == [
+        pytest.approx(57.5)
+    ]
+    assert interpolate_device_readings(3 * 3600)(broken).empty
+
+
+def test_interpolate_leaves_edges_and_single_rows():
+    interpolate = interpolate_device_readings(max_gap_seconds=6 * 3600)
+
+    assert interpolate(readings((0, -1.0), (1, 60.0), (2, 70.0))).empty
+    assert interpolate(readings((0, 60.0), (1, 70.0), (2, -1.0))).empty
+    assert interpolate(readings((0, -1.0))).empty
+    assert interpolate(readings((0, 60.0))).empty
+    assert interpolate(readings((0, 60.0), (1, 70.0))).empty
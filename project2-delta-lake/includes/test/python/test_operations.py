@@ -5,8 +5,12 @@
 
 # COMMAND ----------
 
+import datetime
+
 import pytest
+from delta.exceptions import ConcurrentAppendException
 from pyspark.sql import SparkSession
+from pyspark.sql.functions import col, when
 from pyspark.sql.types import *
 
 # COMMAND ----------
@@ -22,7 +26,44 @@ spark = sql.SparkSession.builder.master("local[8]").getOrCreate()
 
 # COMMAND ----------
 
-from main.python.operations import transform_raw
+import main.python.operations as operations
+from pipeline_config import PipelineConfig
+from main.python.arrow_engine import arrow_timezone
+from main.python.delta_log import commit_files, snapshot_files
+from main.python.schema_registry import (
+    HEALTH_TRACKER_SCHEMAS,
+    register_schema,
+    union_schema_fields,
+)
+from main.python.stream_profiles import STREAM_PROFILES, rate_limit_options
+from main.python.operations import (
+    HEARTRATE_STATE_MERGE,
+    SILVER_BUCKET_TARGET_BYTES,
+    SILVER_DEVICE_BUCKETS,
+    IdempotentBatch,
+    accepts_pipeline_config,
+    apply_silver_layout,
+    create_late_arrival_stream_writer,
+    create_silver_table,
+    create_stream_writer,
+    device_buckets_for,
+    flag_anomalies,
+    merge_late_arrivals,
+    read_device_range,
+    read_stream_delta,
+    read_stream_raw,
+    replay_silver,
+    silver_device_buckets,
+    silver_layout,
+    transform_bronze,
+    transform_gold_state,
+    transform_raw,
+    transform_silver_mean_agg,
+    transform_bronze_validated,
+    transform_silver_partial_agg,
+    update_file_index,
+    update_silver_table,
+)
 
 # COMMAND ----------
 
@@ -70,3 +111,683 @@ def test_transform_raw(spark_session: SparkSession):
         ]
     )
 
+
+# COMMAND ----------
+
+def test_transform_raw_with_hash(spark_session: SparkSession):
+    testDF = spark_session.createDataFrame(
+        [
+            (
+                '{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":1.5778368E9}',
+            ),
+            (
+                '{"device_id":0,"heartrate":53.9078900098,"name":"Deborah Powell","time":1.5778404E9}',
+            ),
+        ],
+        schema="value STRING",
+    )
+    transformedDF = transform_raw(testDF, with_hash=True)
+    assert transformedDF.schema == StructType(
+        [
+            StructField("datasource", StringType(), False),
+            StructField("ingesttime", TimestampType(), False),
+            StructField("value", StringType(), True),
+            StructField("value_hash", LongType(), False),
+            StructField("value_length", IntegerType(), True),
+            StructField("p_ingestdate", DateType(), False),
+        ]
+    )
+    assert transformedDF.select("value_hash").distinct().count() == 2
+
+
+# COMMAND ----------
+
+def test_transform_raw_parsed(spark_session: SparkSession):
+    testDF = spark_session.createDataFrame(
+        [
+            (
+                '{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":1.5778368E9}',
+            ),
+            (
+                '{"device_id":1,"heartrate":-1.0,"name":"Sarah Jones","time":1.5779232E9}',
+            ),
+        ],
+        schema="value STRING",
+    )
+    parsedDF = transform_raw(testDF, parsed=True)
+    assert parsedDF.columns == [
+        "datasource",
+        "ingesttime",
+        "value",
+        "device_id",
+        "heartrate",
+        "eventtime",
+        "name",
+        "p_eventdate",
+        "p_ingestdate",
+    ]
+
+    silverDF = transform_bronze(parsedDF)
+    expectedDF = transform_bronze(transform_raw(testDF))
+    assert silverDF.schema == expectedDF.schema
+    assert sorted(silverDF.collect()) == sorted(expectedDF.collect())
+
+
+# COMMAND ----------
+
+def test_merge_late_arrivals(spark_session: SparkSession, tmp_path):
+    records = [
+        '{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":1.5778368E9}',
+        '{"device_id":0,"heartrate":53.9078900098,"name":"Deborah Powell","time":1.5778404E9}',
+        '{"device_id":1,"heartrate":57.1281154978,"name":"Sarah Jones","time":1.5778368E9}',
+    ]
+    rawDF = spark_session.createDataFrame(
+        [(value,) for value in records], "value STRING"
+    )
+    bronzePath = str(tmp_path / "bronze")
+    bronzeDF = transform_raw(rawDF, with_hash=True, parsed=True)
+    # The second record predates value_hash and must match on (device_id, eventtime).
+    (
+        bronzeDF.withColumn(
+            "value_hash",
+            when(col("value") == records[1], None).otherwise(col("value_hash")),
+        )
+        .write.format("delta")
+        .save(bronzePath)
+    )
+
+    lateDF = spark_session.createDataFrame(
+        [
+            (records[0],),
+            (records[1],),
+            (
+                '{"device_id":1,"heartrate":58.0,"name":"Sarah Jones","time":1.5778404E9}',
+            ),
+        ],
+        "value STRING",
+    )
+    metrics = merge_late_arrivals(spark_session, bronzePath, lateDF)
+
+    mergedDF = spark_session.read.format("delta").load(bronzePath)
+    assert mergedDF.count() == 4
+    assert mergedDF.where("device_id = 1").count() == 2
+    assert mergedDF.where("eventtime IS NULL OR p_eventdate IS NULL").count() == 0
+    assert metrics["numTargetRowsInserted"] == 1
+
+
+# COMMAND ----------
+
+def test_late_arrivals_reach_silver_once(spark_session: SparkSession, tmp_path):
+    records = [
+        '{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":1.5778368E9}',
+        '{"device_id":1,"heartrate":57.1281154978,"name":"Sarah Jones","time":1.5778368E9}',
+        '{"device_id":0,"heartrate":53.9078900098,"name":"Deborah Powell","time":1.5778404E9}',
+        '{"device_id":1,"heartrate":58.0,"name":"Sarah Jones","time":1.5778404E9}',
+    ]
+    bronzePath, silverPath = str(tmp_path / "bronze"), str(tmp_path / "silver")
+    latePath = tmp_path / "late"
+    latePath.mkdir()
+    bronzeDF = spark_session.createDataFrame(
+        [(value,) for value in records[:2]], "value STRING"
+    )
+    transform_raw(bronzeDF, with_hash=True, parsed=True).write.format("delta").save(
+        bronzePath
+    )
+
+    def run_silver_stream():
+        create_stream_writer(
+            transform_bronze(read_stream_delta(spark_session, bronzePath)),
+            str(tmp_path / "_checkpoint_silver"),
+            "late_test_silver",
+            trigger={"availableNow": True},
+        ).start(silverPath).awaitTermination()
+
+    run_silver_stream()
+    # one record already in bronze, one repeated within the late file
+    (latePath / "late.json").write_text("\n".join(records[1:] + records[3:]))
+    create_late_arrival_stream_writer(
+        read_stream_raw(spark_session, str(latePath)),
+        str(tmp_path / "_checkpoint_late"),
+        "late_test_bronze",
+        bronzePath=bronzePath,
+        trigger={"availableNow": True},
+    ).start().awaitTermination()
+    run_silver_stream()
+
+    silverDF = spark_session.read.format("delta").load(silverPath)
+    assert spark_session.read.format("delta").load(bronzePath).count() == 4
+    assert silverDF.count() == 4
+    assert silverDF.dropDuplicates(["device_id", "eventtime"]).count() == 4
+
+
+# COMMAND ----------
+
+def test_transform_bronze_arrow_engine(spark_session: SparkSession):
+    testDF = spark_session.createDataFrame(
+        [
+            (
+                '{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":1.5778368E9}',
+            ),
+            (
+                '{"device_id":1,"heartrate":-1.0,"name":"Sarah Jones","time":1.5779232E9}',
+            ),
+            ("not json",),
+        ],
+        schema="value STRING",
+    )
+    expectedDF = transform_bronze(testDF)
+    arrowDF = transform_bronze(testDF, engine="arrow")
+    assert arrowDF.schema == StructType(
+        [
+            StructField("device_id", IntegerType(), True),
+            StructField("heartrate", DoubleType(), True),
+            StructField("eventtime", TimestampType(), True),
+            StructField("name", StringType(), True),
+            StructField("p_eventdate", DateType(), True),
+        ]
+    )
+    assert sorted(arrowDF.collect(), key=str) == sorted(expectedDF.collect(), key=str)
+
+
+# COMMAND ----------
+
+def test_transform_bronze_arrow_engine_offset_timezone(spark_session: SparkSession):
+    assert arrow_timezone("America/Los_Angeles") == "America/Los_Angeles"
+    assert str(arrow_timezone("GMT+08:00")) == "UTC+08:00"
+    assert str(arrow_timezone("UTC-05:30")) == "UTC-05:30"
+    assert arrow_timezone("not a zone") == "UTC"
+
+    testDF = spark_session.createDataFrame(
+        [
+            (
+                '{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":1.5778368E9}',
+            ),
+        ],
+        schema="value STRING",
+    )
+    session_timezone = spark_session.conf.get("spark.sql.session.timeZone")
+    spark_session.conf.set("spark.sql.session.timeZone", "GMT+08:00")
+    try:
+        arrowDF = transform_bronze(testDF, engine="arrow")
+        assert arrowDF.collect() == transform_bronze(testDF).collect()
+    finally:
+        spark_session.conf.set("spark.sql.session.timeZone", session_timezone)
+
+
+# COMMAND ----------
+
+def test_merged_heartrate_state_matches_full_aggregation(spark_session: SparkSession):
+    silverDF = spark_session.createDataFrame(
+        [
+            (device_id, float(50 + device_id * 3 + i % 7))
+            for device_id in range(3)
+            for i in range(20)
+        ]
+        + [(3, 61.0)],
+        schema="device_id INTEGER, heartrate DOUBLE",
+    )
+    first, second = silverDF.randomSplit([0.5, 0.5], seed=7)
+
+    stateDF = transform_silver_partial_agg(first).alias("state")
+    updatesDF = transform_silver_partial_agg(second).alias("updates")
+    mergedDF = stateDF.join(updatesDF, "device_id").selectExpr(
+        "device_id",
+        *[
+            f"{expression} AS {column}"
+            for column, expression in HEARTRATE_STATE_MERGE.items()
+        ],
+    )
+    foldedDF = mergedDF.unionByName(
+        stateDF.join(updatesDF, "device_id", "left_anti")
+    ).unionByName(updatesDF.join(stateDF, "device_id", "left_anti"))
+
+    expected = {row.device_id: row for row in transform_silver_mean_agg(silverDF).collect()}
+    actual = {row.device_id: row for row in transform_gold_state(foldedDF).collect()}
+
+    assert actual.keys() == expected.keys()
+    for device_id, row in expected.items():
+        assert actual[device_id].mean_heartrate == pytest.approx(row.mean_heartrate)
+        assert actual[device_id].max_heartrate == row.max_heartrate
+        if row.std_heartrate is None:
+            assert actual[device_id].std_heartrate is None
+        else:
+            assert actual[device_id].std_heartrate == pytest.approx(row.std_heartrate)
+
+
+# COMMAND ----------
+
+def test_transform_bronze_versioned(spark_session: SparkSession):
+    testDF = spark_session.createDataFrame(
+        [
+            (
+                '{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":1.5778368E9}',
+            ),
+            (
+                '{"device_id":1,"heartrate":57.2,"device_type":"version 2","name":"Sarah Jones","time":1.5778368E9}',
+            ),
+        ],
+        schema="value STRING",
+    )
+    for engine in ["from_json", "arrow"]:
+        versionedDF = transform_bronze(testDF, engine=engine, versioned=True)
+        assert versionedDF.columns == [
+            "device_id",
+            "heartrate",
+            "eventtime",
+            "name",
+            "p_eventdate",
+            "device_type",
+            "schema_version",
+        ]
+        rows = {row.device_id: row for row in versionedDF.collect()}
+        assert (rows[0].schema_version, rows[0].device_type) == (1, None)
+        assert (rows[1].schema_version, rows[1].device_type) == (2, "version 2")
+
+
+def test_register_schema_parses_ddl(spark_session: SparkSession):
+    register_schema(
+        3,
+        "device_id INTEGER, heartrate DOUBLE, device_type STRING, name STRING, "
+        "time FLOAT, calories DECIMAL(10,2)",
+    )
+    try:
+        assert union_schema_fields()[-1] == ("calories", "decimal(10,2)")
+        with pytest.raises(ValueError, match="changes type"):
+            register_schema(4, "device_id STRING, time FLOAT")
+        assert 4 not in HEALTH_TRACKER_SCHEMAS
+    finally:
+        del HEALTH_TRACKER_SCHEMAS[3]
+
+
+# COMMAND ----------
+
+def test_transform_bronze_validated(spark_session: SparkSession):
+    good = '{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":1.5778368E9}'
+    truncated = '{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell"'
+    unnamed = '{"device_id":0,"heartrate":52.8139067501,"time":1.5778368E9}'
+    mistyped = '{"device_id":"zero","heartrate":52.8,"name":"Deborah Powell","time":1.5778368E9}'
+    testDF = spark_session.createDataFrame(
+        [(good,), (truncated,), (unnamed,), (mistyped,)], schema="value STRING"
+    )
+    validatedDF = transform_bronze_validated(transform_raw(testDF))
+    errors = {row.value: row.parse_error for row in validatedDF.collect()}
+
+    assert errors[good] is None
+    assert errors[truncated] == "malformed json"
+    assert errors[unnamed] == "missing name"
+    assert errors[mistyped].startswith("invalid device_id")
+    assert validatedDF.columns[-3:] == ["value", "p_ingestdate", "parse_error"]
+
+
+# COMMAND ----------
+
+def test_apply_silver_layout(spark_session: SparkSession):
+    testDF = spark_session.createDataFrame(
+        [
+            (device_id % 7, 60.0, f"2020-01-0{device_id % 3 + 1} 00:00:00")
+            for device_id in range(50)
+        ],
+        schema="device_id INTEGER, heartrate DOUBLE, eventtime STRING",
+    ).selectExpr("device_id", "heartrate", "cast(eventtime AS TIMESTAMP) AS eventtime")
+
+    assert apply_silver_layout(testDF, "date").columns == testDF.columns
+
+    bucketedDF = apply_silver_layout(testDF, "device_bucketed")
+    assert bucketedDF.columns == testDF.columns + ["p_device_bucket"]
+    buckets = bucketedDF.groupBy("device_id").agg(
+        {"p_device_bucket": "collect_set"}
+    ).collect()
+    for row in buckets:
+        (bucket,) = row[1]
+        assert 0 <= bucket < SILVER_DEVICE_BUCKETS
+
+    twoBucketsDF = apply_silver_layout(testDF, "device_bucketed", 2)
+    assert {row.p_device_bucket for row in twoBucketsDF.collect()} <= {0, 1}
+
+    with pytest.raises(ValueError):
+        apply_silver_layout(testDF, "by_device")
+
+
+def test_create_silver_table_sizes_buckets(spark_session: SparkSession, tmp_path):
+    assert device_buckets_for(0) == 1
+    assert device_buckets_for(SILVER_BUCKET_TARGET_BYTES * 3 + 1) == 4
+    assert device_buckets_for(SILVER_BUCKET_TARGET_BYTES * 100) == SILVER_DEVICE_BUCKETS
+
+    silverDF = spark_session.createDataFrame(
+        [(0, 60.0)], "device_id INTEGER, heartrate DOUBLE"
+    ).selectExpr(
+        "*", "current_timestamp() AS eventtime", "current_date() AS p_eventdate"
+    )
+    smallPath, datePath = str(tmp_path / "small"), str(tmp_path / "date")
+    create_silver_table(spark_session, smallPath, silverDF, "device_bucketed", 1024)
+    create_silver_table(spark_session, datePath, silverDF, "date")
+
+    assert silver_layout(spark_session, smallPath) == "device_bucketed"
+    assert silver_device_buckets(spark_session, smallPath) == 1
+    assert silver_layout(spark_session, datePath) == "date"
+    assert silver_device_buckets(spark_session, datePath) is None
+
+
+# COMMAND ----------
+
+def silver_readings(spark_session: SparkSession, *rows):
+    return spark_session.createDataFrame(
+        rows, "device_id INTEGER, eventtime STRING, heartrate DOUBLE"
+    ).selectExpr(
+        "device_id",
+        "heartrate",
+        "cast(eventtime AS TIMESTAMP) AS eventtime",
+        "'Deborah Powell' AS name",
+        "cast(eventtime AS DATE) AS p_eventdate",
+    )
+
+
+def silver_heartrates(spark_session: SparkSession, silverPath: str) -> dict:
+    return {
+        (row.device_id, str(row.eventtime)): row.heartrate
+        for row in spark_session.read.format("delta").load(silverPath).collect()
+    }
+
+
+def test_update_silver_table_window_neighbouring_days(
+    spark_session: SparkSession, tmp_path
+):
+    silverPath = str(tmp_path / "silver")
+    silver_readings(
+        spark_session,
+        # previous reading on the day before
+        (0, "2020-01-01 23:00:00", 60.0),
+        (0, "2020-01-02 00:00:00", -1.0),
+        (0, "2020-01-02 01:00:00", 70.0),
+        # next reading on the day after
+        (1, "2020-01-02 22:00:00", 50.0),
+        (1, "2020-01-02 23:00:00", -1.0),
+        (1, "2020-01-03 00:00:00", 54.0),
+    ).write.format("delta").partitionBy("p_eventdate").save(silverPath)
+
+    assert update_silver_table(spark_session, silverPath, engine="window")
+
+    heartrates = silver_heartrates(spark_session, silverPath)
+    assert heartrates[(0, "2020-01-02 00:00:00")] == pytest.approx(65.0)
+    assert heartrates[(1, "2020-01-02 23:00:00")] == pytest.approx(52.0)
+    assert len(heartrates) == 6
+    assert min(heartrates.values()) > 0
+
+
+def test_update_silver_table_window_bucketed(spark_session: SparkSession, tmp_path):
+    silverPath = str(tmp_path / "silver")
+    readingsDF = silver_readings(
+        spark_session,
+        *[
+            (device_id, f"2020-01-01 {hour:02d}:00:00", heartrate)
+            for device_id in range(4)
+            for hour, heartrate in [
+                (0, 60.0),
+                (1, -1.0 if device_id % 2 == 0 else 65.0),
+                (2, 70.0),
+            ]
+        ],
+    )
+    create_silver_table(spark_session, silverPath, readingsDF, "device_bucketed")
+    # one file per (date, bucket) partition
+    apply_silver_layout(readingsDF, "device_bucketed").coalesce(1).write.format(
+        "delta"
+    ).mode("append").save(silverPath)
+    brokenBuckets = {
+        row.p_device_bucket
+        for row in spark_session.read.format("delta")
+        .load(silverPath)
+        .where("heartrate < 0")
+        .collect()
+    }
+
+    assert update_silver_table(spark_session, silverPath, engine="window")
+
+    silverDF = spark_session.read.format("delta").load(silverPath)
+    assert silverDF.count() == 12
+    assert silverDF.where("heartrate < 0").count() == 0
+    assert {
+        row.device_id: row.heartrate
+        for row in silverDF.where("hour(eventtime) = 1").collect()
+    } == {0: 65.0, 1: 65.0, 2: 65.0, 3: 65.0}
+    # the match is limited to the broken devices' buckets
+    metrics = spark_session.sql(
+        f"DESCRIBE HISTORY delta.`{silverPath}` LIMIT 1"
+    ).first().operationMetrics
+    assert int(metrics["numTargetRowsUpdated"]) == 2
+    assert int(metrics["numTargetFilesRemoved"]) == len(brokenBuckets)
+
+
+# COMMAND ----------
+
+def test_replay_silver_retries_on_fresh_bronze(
+    spark_session: SparkSession, tmp_path, monkeypatch
+):
+    records = [
+        '{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":1.57788E9}',
+        '{"device_id":1,"heartrate":57.1281154978,"name":"Sarah Jones","time":1.57788E9}',
+        '{"device_id":0,"heartrate":53.9078900098,"name":"Deborah Powell","time":1.5778836E9}',
+    ]
+    bronzePath, silverPath = str(tmp_path / "bronze"), str(tmp_path / "silver")
+
+    def append_bronze(values):
+        rawDF = spark_session.createDataFrame(
+            [(value,) for value in values], "value STRING"
+        )
+        transform_raw(rawDF, parsed=True).write.format("delta").mode("append").save(
+            bronzePath
+        )
+
+    append_bronze(records[:2])
+    apply_layout = operations.apply_silver_layout
+    calls = []
+
+    def racing_apply_layout(*args, **kwargs):
+        # the live stream lands a reading of the date between the two attempts
+        calls.append(args)
+        if len(calls) == 1:
+            append_bronze(records[2:])
+            raise ConcurrentAppendException("silver changed concurrently")
+        return apply_layout(*args, **kwargs)
+
+    monkeypatch.setattr(operations, "apply_silver_layout", racing_apply_layout)
+    eventDate = datetime.date(2020, 1, 1)
+    rows = replay_silver(
+        spark_session,
+        bronzePath,
+        silverPath,
+        eventDate,
+        eventDate,
+        interpolate=False,
+        retries=1,
+        initial_backoff=0.0,
+    )
+
+    assert len(calls) == 2
+    assert rows == {"2020-01-01": 3}
+    assert spark_session.read.format("delta").load(silverPath).count() == 3
+
+
+# COMMAND ----------
+
+def scanned_files(dataframe) -> int:
+    """Files opened by the scans of dataframe's last execution."""
+    plan = dataframe._jdf.queryExecution().executedPlan()
+    if plan.nodeName() == "AdaptiveSparkPlan":
+        plan = plan.executedPlan()
+    leaves = plan.collectLeaves()
+    metrics = [leaves.apply(i).metrics() for i in range(leaves.length())]
+    return sum(
+        metric.apply("numFiles").value()
+        for metric in metrics
+        if metric.contains("numFiles")
+    )
+
+
+def test_read_device_range(spark_session: SparkSession, tmp_path):
+    silverPath = str(tmp_path / "silver")
+
+    def append_silver(*rows):
+        (
+            spark_session.createDataFrame(
+                rows, "device_id INTEGER, eventtime STRING, heartrate DOUBLE"
+            )
+            .selectExpr(
+                "device_id",
+                "cast(eventtime AS TIMESTAMP) AS eventtime",
+                "heartrate",
+                "cast(eventtime AS DATE) AS p_eventdate",
+            )
+            .coalesce(1)
+            .write.format("delta")
+            .mode("append")
+            .partitionBy("p_eventdate")
+            .save(silverPath)
+        )
+
+    append_silver((0, "2020-01-01 10:00:00", 60.0), (1, "2020-01-01 10:00:00", 70.0))
+    append_silver((5, "2020-01-01 10:00:00", 80.0), (6, "2020-01-01 11:00:00", 90.0))
+    append_silver((0, "2020-01-02 10:00:00", 61.0))
+    assert update_file_index(spark_session, silverPath) == 3
+    # written after the sync, so only the Delta log knows of it
+    append_silver((0, "2020-01-01 12:00:00", 62.0))
+
+    readingsDF = read_device_range(
+        spark_session,
+        silverPath,
+        0,
+        datetime.datetime(2020, 1, 1, 1),
+        datetime.datetime(2020, 1, 1, 22),
+    )
+
+    assert sorted(row.heartrate for row in readingsDF.collect()) == [60.0, 62.0]
+    # neither the file of devices 5-6 nor the 2020-01-02 partition is opened
+    assert scanned_files(readingsDF) == 2
+
+
+# COMMAND ----------
+
+def test_idempotent_batch_app_ids(spark_session: SparkSession):
+    batch = IdempotentBatch(spark_session, "bronze_to_silver", 7)
+    assert batch._txn_app_id("/silver") == "bronze_to_silver"
+    assert batch._txn_app_id("/quarantine") == "bronze_to_silver"
+    assert batch._txn_app_id("/silver") == "bronze_to_silver#2"
+
+    # a retry of the batch issues the same identifiers in the same order
+    retry = IdempotentBatch(spark_session, "bronze_to_silver", 7)
+    assert [retry._txn_app_id(path) for path in ["/silver", "/silver"]] == [
+        "bronze_to_silver",
+        "bronze_to_silver#2",
+    ]
+
+
+# COMMAND ----------
+
+def test_flag_anomalies(spark_session: SparkSession):
+    readingsDF = spark_session.createDataFrame(
+        [
+            (0, "2020-01-01 00:00:00", 61.0, 60.5),
+            (0, "2020-01-01 01:00:00", 95.0, 64.0),
+            (1, "2020-01-01 00:00:00", 74.0, 72.0),
+            (2, "2020-01-01 00:00:00", 200.0, 200.0),
+        ],
+        schema="device_id INTEGER, eventtime STRING, heartrate DOUBLE, "
+        "ewma_heartrate DOUBLE",
+    ).selectExpr(
+        "device_id",
+        "cast(eventtime AS TIMESTAMP) AS eventtime",
+        "heartrate",
+        "ewma_heartrate",
+        "cast(eventtime AS DATE) AS p_eventdate",
+    )
+    baselineDF = spark_session.createDataFrame(
+        [(0, 60.0, 5.0), (1, 60.0, 5.0)],
+        schema="device_id INTEGER, mean_heartrate DOUBLE, std_heartrate DOUBLE",
+    )
+
+    alerts = {
+        (row.device_id, row.heartrate): row.reason
+        for row in flag_anomalies(readingsDF, baselineDF).collect()
+    }
+    # device 2 has no baseline yet
+    # device 1 is within threshold alone (z 2.8) but its EWMA drifted (z 2.4)
+    assert alerts == {(0, 95.0): "spike", (1, 74.0): "drift"}
+
+
+# COMMAND ----------
+
+def test_accepts_pipeline_config(spark_session: SparkSession):
+    @accepts_pipeline_config
+    def writer(dataframe, checkpoint: str, name: str, silverPath: str, mode="append"):
+        return checkpoint, name, silverPath, mode
+
+    config = PipelineConfig("tenant_a")
+    assert writer(None, name="write_bronze_to_silver", config=config) == (
+        config.checkpointPath + "write_bronze_to_silver/",
+        "tenant_a__write_bronze_to_silver",
+        config.silverPath,
+        "append",
+    )
+    assert writer(
+        None, "/checkpoint", "query", silverPath="/silver", config=config
+    )[::2] == ("/checkpoint", "/silver")
+    # a config-backed path bound by position would shift the arguments after it
+    with pytest.raises(TypeError, match="silverPath"):
+        writer(None, "/checkpoint", "query", "/silver", config=config)
+    assert writer(None, "/checkpoint", "query", "/silver") == (
+        "/checkpoint",
+        "query",
+        "/silver",
+        "append",
+    )
+
+
+# COMMAND ----------
+
+def testrate_limit_options(spark_session: SparkSession):
+    assert rate_limit_options("backfill") == {
+        "maxFilesPerTrigger": "1000",
+        "maxBytesPerTrigger": "10g",
+    }
+    assert rate_limit_options("low-latency") == {
+        "maxFilesPerTrigger": "10",
+        "maxBytesPerTrigger": "64m",
+    }
+    assert rate_limit_options("steady") == {
+        "maxFilesPerTrigger": "100",
+        "maxBytesPerTrigger": "1g",
+    }
+    assert all(
+        "trigger" not in rate_limit_options(profile) for profile in STREAM_PROFILES
+    )
+    assert rate_limit_options(None) == {}
+    assert rate_limit_options(
+        "steady", maxFilesPerTrigger=5, maxBytesPerTrigger=None
+    ) == {"maxFilesPerTrigger": "5", "maxBytesPerTrigger": "1g"}
+
+    with pytest.raises(ValueError, match="Unknown stream profile 'bursty'"):
+        rate_limit_options("bursty")
+
+
+# COMMAND ----------
+
+def test_snapshot_files(spark_session: SparkSession, tmp_path):
+    path = str(tmp_path / "table")
+    rowsDF = spark_session.range(100).selectExpr("id", "id % 4 AS p_bucket")
+    rowsDF.write.format("delta").partitionBy("p_bucket").save(path)
+    rowsDF.write.format("delta").mode("append").partitionBy("p_bucket").save(path)
+    (
+        rowsDF.where("p_bucket = 0")
+        .write.format("delta")
+        .mode("overwrite")
+        .option("replaceWhere", "p_bucket = 0")
+        .save(path)
+    )
+
+    filesDF = snapshot_files(spark_session, path)
+    tableDF = spark_session.read.format("delta").load(path)
+    assert sorted(row.path.split("/")[-1] for row in filesDF.collect()) == sorted(
+        name.split("/")[-1] for name in tableDF.inputFiles()
+    )
+    replacedDF = commit_files(spark_session, path, 2)
+    assert {row.partitionValues["p_bucket"] for row in replacedDF.collect()} == {"0"}
@@ -0,0 +1,40 @@
+# Databricks notebook source
+# MAGIC 
+# MAGIC %md
+# MAGIC # Unit Tests for Pipeline Configuration
+
+# COMMAND ----------
+
+import pytest
+
+from pipeline_config import PipelineConfig
+
+# COMMAND ----------
+
+def test_pipeline_config_paths():
+    config = PipelineConfig("jane.doe@example.com")
+    assert config.rawPath == "/dbacademy/jane.doe@example.com/dataengineering/plus/raw/"
+    assert config.silverCheckpoint == config.checkpointPath + "silver/"
+    assert config.database == "dbacademy_jane_doe_example_com"
+    assert config.table("health_tracker_plus_silver") == (
+        "dbacademy_jane_doe_example_com.health_tracker_plus_silver"
+    )
+
+
+def test_pipeline_config_streams_are_scoped_to_the_tenant():
+    first, second = PipelineConfig("tenant_a"), PipelineConfig("tenant_b")
+    assert first.stream_name("write_raw_to_bronze") != second.stream_name(
+        "write_raw_to_bronze"
+    )
+
+    name = first.stream_name("write_raw_to_bronze")
+    assert first.stream_name(name) == name
+    assert first.checkpoint(name) == first.checkpoint("write_raw_to_bronze")
+    assert first.checkpoint(name).startswith(first.checkpointPath)
+
+
+def test_pipeline_config_rejects_unsafe_tenant_ids():
+    with pytest.raises(ValueError):
+        PipelineConfig("")
+    with pytest.raises(ValueError):
+        PipelineConfig("../other_tenant")
@@ -0,0 +1,221 @@
+# Databricks notebook source
+# MAGIC 
+# MAGIC %md
+# MAGIC # Unit Tests for Utilities
+
+# COMMAND ----------
+
+import os
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import utilities
+from utilities import (
+    StreamProgressWaiter,
+    StreamSupervisor,
+    batches_processed,
+    input_rows_at_least,
+    month_range,
+    retrieve_data_bulk,
+    source_caught_up,
+    stop_streams,
+)
+
+# COMMAND ----------
+
+def _write_source(source: Path, year: int, month: int, late: str = "") -> bytes:
+    body = (
+        f'{{"device_id":0,"heartrate":52.8139067501,"name":"Deborah Powell","time":{month}.0}}\n'
+    ).encode()
+    (source / f"health_tracker_data_{year}_{month}{late}.json").write_bytes(body)
+    return body
+
+
+# COMMAND ----------
+
+def test_month_range():
+    assert month_range((2019, 12), (2020, 2)) == [
+        (2019, 12, False),
+        (2020, 1, False),
+        (2020, 2, False),
+    ]
+    assert month_range((2020, 1), (2020, 1), include_late=True) == [
+        (2020, 1, False),
+        (2020, 1, True),
+    ]
+
+
+# COMMAND ----------
+
+def test_retrieve_data_bulk(tmp_path: Path):
+    source = tmp_path / "source"
+    source.mkdir()
+    expected = {
+        "health_tracker_data_2020_1.json": _write_source(source, 2020, 1),
+        "health_tracker_data_2020_2.json": _write_source(source, 2020, 2),
+        "late/health_tracker_data_2020_2_late.json": _write_source(source, 2020, 2, "_late"),
+    }
+    raw_path = str(tmp_path / "raw") + "/"
+    base_url = source.as_uri() + "/"
+    handles = [(2020, 1, False), (2020, 2, False), (2020, 2, True)]
+
+    first = retrieve_data_bulk(handles, raw_path, base_url=base_url, max_workers=2)
+    assert set(first.values()) == {"downloaded"}
+    for name, body in expected.items():
+        assert (Path(raw_path) / name).read_bytes() == body
+    assert (tmp_path / "raw_manifest.json").exists()
+
+    second = retrieve_data_bulk(handles, raw_path, base_url=base_url, max_workers=2)
+    assert set(second.values()) == {"skipped"}
+
+    os.remove(Path(raw_path) / "health_tracker_data_2020_1.json")
+    third = retrieve_data_bulk(handles, raw_path, base_url=base_url, max_workers=2)
+    assert third["health_tracker_data_2020_1.json"] == "downloaded"
+    assert not list(Path(raw_path).glob(".*.part"))
+
+
+def test_retrieve_data_bulk_needs_a_raw_path():
+    with pytest.raises(ValueError, match="raw_path"):
+        retrieve_data_bulk([(2020, 1, False)])
+
+
+# COMMAND ----------
+
+class _NoActiveStreams:
+    class streams:
+        active = []
+
+
+def _progress(
+    second: int, rows: int, end: int, latest: int, run_id: str = "run-1"
+) -> dict:
+    return {
+        "name": "write_raw_to_bronze",
+        "runId": run_id,
+        "batchId": second,
+        "timestamp": f"2020-01-01T00:00:{second:02d}.000Z",
+        "numInputRows": rows,
+        "sources": [{"endOffset": str(end), "latestOffset": str(latest)}],
+    }
+
+
+def test_stream_progress_waiter_conditions():
+    waiter = StreamProgressWaiter()
+    spark = _NoActiveStreams()
+
+    assert not waiter.wait_for(spark, "write_raw_to_bronze", batches_processed(1), 0)
+
+    waiter._record(_progress(1, 100, 1, 3))
+    waiter._record(_progress(1, 100, 1, 3))
+    waiter._record(_progress(2, 50, 2, 3))
+    assert waiter.wait_for(spark, "write_raw_to_bronze", batches_processed(2), 0)
+    assert not waiter.wait_for(spark, "write_raw_to_bronze", batches_processed(3), 0)
+    assert waiter.wait_for(spark, "write_raw_to_bronze", input_rows_at_least(150), 0)
+    assert not waiter.wait_for(spark, "write_raw_to_bronze", source_caught_up(), 0)
+
+    waiter._record(_progress(3, 10, 3, 3))
+    assert waiter.wait_for(spark, "write_raw_to_bronze", source_caught_up(), 0)
+
+
+def test_stream_progress_waiter_counts_each_run_and_batch_once():
+    waiter = StreamProgressWaiter()
+    spark = _NoActiveStreams()
+
+    waiter._record(_progress(1, 100, 1, 3))
+    # an idle progress repeats the batch id with a later timestamp
+    waiter._record({**_progress(1, 0, 1, 3), "timestamp": "2020-01-01T00:00:09.000Z"})
+    assert waiter.batches(spark, "write_raw_to_bronze") == 1
+
+    class started:
+        id = "query-1"
+        runId = "run-2"
+        name = "write_raw_to_bronze"
+
+    waiter.onQueryStarted(started)
+    assert waiter.batches(spark, "write_raw_to_bronze") == 0
+    waiter._record(_progress(1, 10, 1, 3, run_id="run-2"))
+    waiter.onQueryStarted(started)
+    assert waiter.batches(spark, "write_raw_to_bronze") == 1
+
+
+# COMMAND ----------
+
+class _FakeQuery:
+    def __init__(self, name: str, query_id: int):
+        self.name = name
+        self.id = query_id
+        self.isActive = True
+        self.status = {"isTriggerActive": False}
+        self.recentProgress = []
+
+    def stop(self) -> None:
+        self.isActive = False
+
+
+class _FakeWriter:
+    def __init__(self, name: str):
+        self.name = name
+        self.starts = 0
+        self.restarted = threading.Event()
+
+    def start(self, path: str = None) -> _FakeQuery:
+        self.starts += 1
+        if self.starts > 1:
+            self.restarted.set()
+        return _FakeQuery(self.name, self.starts)
+
+
+class _FakeSpark:
+    def __init__(self, active: list = ()):
+        self.streams = SimpleNamespace(
+            active=list(active), addListener=lambda listener: None
+        )
+
+
+def test_stream_supervisor_restarts_failed_queries():
+    events = []
+    writer = _FakeWriter("write_raw_to_bronze")
+    supervisor = StreamSupervisor(
+        _FakeSpark(),
+        writers={"write_raw_to_bronze": writer},
+        initial_backoff=0.0,
+        max_restarts=1,
+        on_event=events.append,
+    )
+    query = supervisor.start("write_raw_to_bronze")
+    supervisor.onQueryStarted(SimpleNamespace(id=query.id, name=query.name))
+
+    # a clean stop is not a failure
+    supervisor.onQueryTerminated(SimpleNamespace(id=query.id, exception=None))
+    assert writer.starts == 1
+
+    supervisor.onQueryStarted(SimpleNamespace(id=query.id, name=query.name))
+    supervisor.onQueryTerminated(SimpleNamespace(id=query.id, exception="boom"))
+    assert writer.restarted.wait(5)
+    assert events[0]["event"] == "restart_scheduled"
+
+    supervisor.onQueryStarted(SimpleNamespace(id=2, name=query.name))
+    supervisor.onQueryTerminated(SimpleNamespace(id=2, exception="boom"))
+    assert events[-1]["event"] == "gave_up"
+
+
+def test_stream_supervisor_defaults_to_stream_writers(monkeypatch):
+    writer = _FakeWriter("write_raw_to_bronze")
+    monkeypatch.setattr(
+        utilities,
+        "STREAM_WRITERS",
+        {"write_raw_to_bronze": writer},
+        raising=False,
+    )
+    supervisor = StreamSupervisor(_FakeSpark(), on_event=lambda event: None)
+    supervisor.start("write_raw_to_bronze")
+    assert writer.starts == 1
+
+
+def test_stop_streams_in_parallel():
+    queries = [_FakeQuery(f"stream_{index}", index) for index in range(8)]
+    assert stop_streams(_FakeSpark(queries), queries, drain_timeout=0) == 8
+    assert not any(query.isActive for query in queries)
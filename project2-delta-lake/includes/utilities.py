@@ -1,21 +1,164 @@
 # Databricks notebook source
 
+from concurrent.futures import ThreadPoolExecutor
 from pyspark.sql.session import SparkSession
-from urllib.request import urlretrieve
+from pyspark.sql.streaming import StreamingQueryListener
+from threading import Condition, Lock, Timer
+from typing import Callable, Dict, Iterable, List, Tuple
+from urllib.request import Request, urlopen, urlretrieve
+import hashlib
+import json
+import os
 import time
 
 BASE_URL = "https://files.training.databricks.com/static/data/health-tracker/"
 
+CHUNK_SIZE = 1 << 20
 
-def retrieve_data(year: int, month: int, raw_path: str, is_late: bool = False) -> bool:
+
+def _raw_path(raw_path: str, config) -> str:
+    if raw_path is not None:
+        return raw_path
+    if config is None:
+        raise ValueError("Pass raw_path or a PipelineConfig as config")
+    return config.rawPath
+
+
+def retrieve_data(
+    year: int,
+    month: int,
+    raw_path: str = None,
+    is_late: bool = False,
+    base_url: str = BASE_URL,
+    config=None,
+) -> bool:
+    raw_path = _raw_path(raw_path, config)
     file, dbfsPath, driverPath = _generate_file_handles(year, month, raw_path, is_late)
-    uri = BASE_URL + file
+    uri = base_url + file
 
     urlretrieve(uri, file)
     dbutils.fs.mv(driverPath, dbfsPath)
     return True
 
 
+def retrieve_data_bulk(
+    files: Iterable[Tuple[int, int, bool]],
+    raw_path: str = None,
+    base_url: str = BASE_URL,
+    max_workers: int = 4,
+    config=None,
+) -> Dict[str, str]:
+    """Fetch many (year, month, is_late) files concurrently into raw_path.
+
+    Files are streamed straight to their target path, partial downloads are
+    resumed, and files whose checksum matches the manifest kept next to
+    raw_path are skipped. Returns a mapping of file name to "downloaded" or
+    "skipped". raw_path defaults to the rawPath of a PipelineConfig.
+    """
+    raw_path = _raw_path(raw_path, config)
+    manifest_path = _manifest_path(raw_path)
+    manifest = _read_manifest(manifest_path)
+    lock = Lock()
+
+    def fetch(handle: Tuple[int, int, bool]) -> Tuple[str, str]:
+        year, month, is_late = handle
+        file, dbfsPath, _ = _generate_file_handles(year, month, raw_path, is_late)
+        target = _local_path(dbfsPath)
+        key = os.path.relpath(target, _local_path(raw_path))
+
+        with lock:
+            entry = manifest.get(key)
+        if entry is not None and os.path.exists(target):
+            if _sha256(target) == entry["sha256"]:
+                return file, "skipped"
+
+        _download(base_url + file, target)
+        with lock:
+            manifest[key] = {"sha256": _sha256(target), "size": os.path.getsize(target)}
+        return file, "downloaded"
+
+    handles = list(dict.fromkeys((y, m, bool(l)) for y, m, l in files))
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(executor.map(fetch, handles))
+    finally:
+        _write_manifest(manifest_path, manifest)
+
+
+def month_range(
+    start: Tuple[int, int], end: Tuple[int, int], include_late: bool = False
+) -> List[Tuple[int, int, bool]]:
+    """Inclusive (year, month, is_late) handles between two (year, month) pairs."""
+    handles = []
+    year, month = start
+    while (year, month) <= end:
+        handles.append((year, month, False))
+        if include_late:
+            handles.append((year, month, True))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return handles
+
+
+def _download(uri: str, target: str) -> None:
+    directory, file = os.path.split(target)
+    os.makedirs(directory, exist_ok=True)
+    # dot-prefixed so the raw text stream never picks up a half-written file
+    partial = os.path.join(directory, f".{file}.part")
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+
+    request = Request(uri)
+    if offset:
+        request.add_header("Range", f"bytes={offset}-")
+
+    with urlopen(request) as response:
+        resumed = offset and getattr(response, "status", None) == 206
+        with open(partial, "ab" if resumed else "wb") as out:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+
+    os.replace(partial, target)
+
+
+def _local_path(path: str) -> str:
+    if path.startswith("file:"):
+        return path[len("file:"):]
+    if path.startswith("dbfs:"):
+        return "/dbfs" + path[len("dbfs:"):]
+    if os.path.isdir("/dbfs") and not path.startswith("/dbfs/"):
+        return "/dbfs" + path
+    return path
+
+
+def _manifest_path(raw_path: str) -> str:
+    return _local_path(raw_path.rstrip("/") + "_manifest.json")
+
+
+def _read_manifest(manifest_path: str) -> Dict[str, dict]:
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest_path: str, manifest: Dict[str, dict]) -> None:
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp = manifest_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, manifest_path)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def _generate_file_handles(year: int, month: int, raw_path: str, is_late: bool):
     late = ""
     if is_late:
@@ -32,28 +175,359 @@ def _generate_file_handles(year: int, month: int, raw_path: str, is_late: bool):
     return file, dbfsPath, driverPath
 
 
-def stop_all_streams() -> bool:
-    stopped = False
-    for stream in spark.streams.active:
-        stopped = True
-        stream.stop()
-    return stopped
+def stop_all_streams(drain_timeout: float = 30.0, config=None) -> bool:
+    """Stop every stream, or only the streams of config's tenant."""
+    names = None
+    if config is not None:
+        names = [
+            query.name
+            for query in spark.streams.active
+            if (query.name or "").startswith(config.name_prefix)
+        ]
+    return stream_supervisor(spark).stop(names, drain_timeout=drain_timeout) > 0
+
+
+def stop_named_stream(
+    spark: SparkSession, namedStream: str, drain_timeout: float = 30.0, config=None
+) -> bool:
+    if config is not None:
+        namedStream = config.stream_name(namedStream)
+    supervisor = stream_supervisor(spark)
+    return supervisor.stop([namedStream], drain_timeout=drain_timeout) > 0
+
+
+def stop_streams(
+    spark: SparkSession,
+    queries: list,
+    drain_timeout: float = 30.0,
+    max_workers: int = 16,
+) -> int:
+    """Stop queries in parallel, each after its in-flight micro-batch commits."""
+    if not queries:
+        return 0
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(queries))) as executor:
+        list(executor.map(lambda q: drain_stream(spark, q, drain_timeout), queries))
+    return len(queries)
+
+
+def drain_stream(spark: SparkSession, query, timeout: float = 30.0) -> None:
+    """Stop query once its running micro-batch has committed, or after timeout.
+
+    Stopping mid-batch throws the batch away and it is recomputed on the next
+    start; an idle query is stopped right away.
+    """
+    if query.name is not None:
+        waiter = _stream_waiter(spark)
+        committed = waiter.batches(spark, query.name)
+        if query.isActive and query.status["isTriggerActive"]:
+            waiter.wait_for(
+                spark, query.name, batches_processed(committed + 1), timeout
+            )
+    query.stop()
+
+
+class StreamSupervisor(StreamingQueryListener):
+    """Starts named stream writers and restarts the queries that fail.
+
+    writers maps query names to DataStreamWriters, by default the
+    STREAM_WRITERS registry filled by the operations writers. A query started
+    through start() that terminates with an exception is restarted after
+    initial_backoff seconds, doubling per consecutive failure up to
+    max_backoff; a run that stayed up healthy_after seconds resets the count,
+    and after max_restarts consecutive failures it is left stopped. Queries
+    stopped through stop() are drained first and never restarted.
+    """
+
+    def __init__(
+        self,
+        spark: SparkSession,
+        writers: dict = None,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 300.0,
+        max_restarts: int = 10,
+        healthy_after: float = 600.0,
+        on_event: Callable[[dict], None] = print,
+    ):
+        self._spark = spark
+        self.writers = writers
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_restarts = max_restarts
+        self.healthy_after = healthy_after
+        self.on_event = on_event
+        self._lock = Lock()
+        self._supervised = {}
+        self._failures = {}
+        self._started_at = {}
+        self._timers = {}
+        self._names = {}
+
+    def start(self, name: str, path: str = None, writer=None):
+        """Start and supervise the writer whose queryName is name."""
+        with self._lock:
+            writers = self.writers if self.writers is not None else _stream_writers()
+            writer = writer or writers[name]
+            self._supervised[name] = (writer, path)
+            self._failures.setdefault(name, 0)
+            self._started_at[name] = time.monotonic()
+        return writer.start(path) if path is not None else writer.start()
+
+    def stop(self, names: Iterable[str] = None, drain_timeout: float = 30.0) -> int:
+        """Drain and stop the named queries, default all active ones, in parallel."""
+        queries = [
+            query
+            for query in self._spark.streams.active
+            if names is None or query.name in names
+        ]
+        with self._lock:
+            unsupervised = set(self._supervised if names is None else names)
+            unsupervised.update(query.name for query in queries)
+            for name in unsupervised:
+                self._supervised.pop(name, None)
+                timer = self._timers.pop(name, None)
+                if timer is not None:
+                    timer.cancel()
+        return stop_streams(self._spark, queries, drain_timeout)
+
+    def onQueryStarted(self, event) -> None:
+        with self._lock:
+            if event.name in self._supervised:
+                self._names[str(event.id)] = event.name
 
+    def onQueryProgress(self, event) -> None:
+        pass
 
-def stop_named_stream(spark: SparkSession, namedStream: str) -> bool:
-    stopped = False
-    for stream in spark.streams.active:
-        if stream.name == namedStream:
-            stopped = True
-            stream.stop()
-    return stopped
+    def onQueryIdle(self, event) -> None:
+        pass
 
+    def onQueryTerminated(self, event) -> None:
+        with self._lock:
+            name = self._names.pop(str(event.id), None)
+            if event.exception is None or name not in self._supervised:
+                return
+            uptime = time.monotonic() - self._started_at.get(name, 0.0)
+            if uptime >= self.healthy_after:
+                self._failures[name] = 0
+            self._failures[name] += 1
+            failures = self._failures[name]
+            if failures > self.max_restarts:
+                self._supervised.pop(name)
+                self.on_event({"name": name, "event": "gave_up", "failures": failures})
+                return
+            delay = min(self.initial_backoff * 2 ** (failures - 1), self.max_backoff)
+            # never restart from the listener bus thread
+            timer = Timer(delay, self._restart, args=(name,))
+            timer.daemon = True
+            self._timers[name] = timer
+        self.on_event(
+            {
+                "name": name,
+                "event": "restart_scheduled",
+                "failures": failures,
+                "delay": delay,
+                "exception": event.exception,
+            }
+        )
+        timer.start()
 
-def untilStreamIsReady(namedStream: str, progressions: int = 3) -> bool:
-    queries = list(filter(lambda query: query.name == namedStream, spark.streams.active))
-    while len(queries) == 0 or len(queries[0].recentProgress) < progressions:
-        time.sleep(5)
-        queries = list(filter(lambda query: query.name == namedStream, spark.streams.active))
+    def _restart(self, name: str) -> None:
+        with self._lock:
+            self._timers.pop(name, None)
+            if name not in self._supervised:
+                return
+            writer, path = self._supervised[name]
+        try:
+            self.start(name, path, writer)
+        except Exception as error:
+            self.on_event(
+                {"name": name, "event": "restart_failed", "error": repr(error)}
+            )
+
+
+def _stream_writers() -> dict:
+    # operations' registry is a notebook global once operations has been %run
+    if "STREAM_WRITERS" in globals():
+        return globals()["STREAM_WRITERS"]
+    from main.python.operations import STREAM_WRITERS
+
+    return STREAM_WRITERS
+
+
+_STREAM_SUPERVISORS = {}
+
+
+def stream_supervisor(spark: SparkSession, **options) -> StreamSupervisor:
+    """The session's StreamSupervisor, created and registered on first use."""
+    key = id(spark)
+    if key not in _STREAM_SUPERVISORS:
+        _STREAM_SUPERVISORS[key] = StreamSupervisor(spark, **options)
+        spark.streams.addListener(_STREAM_SUPERVISORS[key])
+    return _STREAM_SUPERVISORS[key]
+
+
+def untilStreamIsReady(
+    namedStream: str, progressions: int = 3, timeout: float = None, config=None
+) -> bool:
+    ready = wait_for_stream(
+        spark,
+        namedStream,
+        batches_processed(progressions),
+        timeout=timeout,
+        config=config,
+    )
+    if not ready and timeout is not None:
+        raise TimeoutError(
+            "The stream {} was not ready after {} seconds.".format(namedStream, timeout)
+        )
+    if not ready:
+        raise RuntimeError(
+            "The stream {} terminated before it was ready.".format(namedStream)
+        )
     print("The stream {} is active and ready.".format(namedStream))
-    return True
+    return ready
+
+
+# A progress condition receives the stream's state, {"batches": int,
+# "numInputRows": int, "last": latest progress dict}, and returns a bool.
+
+
+def batches_processed(batches: int) -> Callable[[dict], bool]:
+    return lambda state: state["batches"] >= batches
+
+
+def input_rows_at_least(rows: int) -> Callable[[dict], bool]:
+    return lambda state: state["numInputRows"] >= rows
+
+
+def source_caught_up() -> Callable[[dict], bool]:
+    def caught_up(state: dict) -> bool:
+        last = state["last"]
+        if last is None:
+            return False
+        sources = last.get("sources") or []
+        if sources and all(source.get("latestOffset") for source in sources):
+            return all(
+                source.get("endOffset") == source.get("latestOffset")
+                for source in sources
+            )
+        return last.get("numInputRows") == 0
+
+    return caught_up
+
+
+def wait_for_stream(
+    spark: SparkSession,
+    namedStream: str,
+    condition: Callable[[dict], bool] = None,
+    timeout: float = None,
+    config=None,
+) -> bool:
+    """Block until the named stream meets condition, driven by progress events.
+
+    Returns False if the timeout expires or the stream terminates first.
+    """
+    if config is not None:
+        namedStream = config.stream_name(namedStream)
+    return _stream_waiter(spark).wait_for(
+        spark, namedStream, condition or batches_processed(3), timeout
+    )
+
+
+class StreamProgressWaiter(StreamingQueryListener):
+    """Tracks progress per query name and wakes waiters on every event."""
+
+    def __init__(self):
+        self._condition = Condition()
+        self._names = {}
+        self._states = {}
+        self._terminated = set()
+
+    def onQueryStarted(self, event) -> None:
+        with self._condition:
+            self._names[str(event.id)] = event.name
+            self._terminated.discard(event.name)
+            # a restart starts counting from zero, unless _seed already saw this run
+            self._state(event.name, str(event.runId))
+            self._condition.notify_all()
+
+    def onQueryProgress(self, event) -> None:
+        self._record(json.loads(event.progress.json))
+
+    def onQueryIdle(self, event) -> None:
+        pass
+
+    def onQueryTerminated(self, event) -> None:
+        with self._condition:
+            self._terminated.add(self._names.get(str(event.id)))
+            self._condition.notify_all()
+
+    def wait_for(
+        self,
+        spark: SparkSession,
+        namedStream: str,
+        condition: Callable[[dict], bool],
+        timeout: float = None,
+    ) -> bool:
+        self._seed(spark, namedStream)
+
+        def done() -> bool:
+            state = self._states.get(namedStream)
+            if state is not None and condition(state):
+                return True
+            return namedStream in self._terminated
+
+        with self._condition:
+            return self._condition.wait_for(done, timeout) and (
+                namedStream in self._states and condition(self._states[namedStream])
+            )
+
+    def batches(self, spark: SparkSession, namedStream: str) -> int:
+        """Micro-batches the current run of namedStream has committed so far."""
+        self._seed(spark, namedStream)
+        with self._condition:
+            state = self._states.get(namedStream)
+            return 0 if state is None else state["batches"]
+
+    def _seed(self, spark: SparkSession, namedStream: str) -> None:
+        for query in spark.streams.active:
+            if query.name == namedStream:
+                # progress made before the listener saw this run
+                for progress in query.recentProgress:
+                    self._record(progress)
+
+    def _state(self, namedStream: str, run_id: str) -> dict:
+        state = self._states.get(namedStream)
+        if state is None or state["runId"] != run_id:
+            state = {
+                "runId": run_id,
+                "batchIds": set(),
+                "batches": 0,
+                "numInputRows": 0,
+                "last": None,
+            }
+            self._states[namedStream] = state
+        return state
+
+    def _record(self, progress: dict) -> None:
+        with self._condition:
+            state = self._state(progress["name"], progress["runId"])
+            # (runId, batchId) identifies a batch; idle progress repeats the id
+            # of the last batch and seeded progress may be delivered again
+            if progress["batchId"] not in state["batchIds"]:
+                state["batchIds"].add(progress["batchId"])
+                state["batches"] += 1
+                state["numInputRows"] += progress.get("numInputRows") or 0
+            state["last"] = progress
+            self._condition.notify_all()
+
+
+_STREAM_WAITERS = {}
+
+
+def _stream_waiter(spark: SparkSession) -> StreamProgressWaiter:
+    key = id(spark)
+    if key not in _STREAM_WAITERS:
+        _STREAM_WAITERS[key] = StreamProgressWaiter()
+        spark.streams.addListener(_STREAM_WAITERS[key])
+    return _STREAM_WAITERS[key]
 
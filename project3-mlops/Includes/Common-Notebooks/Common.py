@@ -35,9 +35,10 @@ courseAdvertisements["databaseName"] = ("d", databaseName, "This is a private, p
 # ****************************************************************************
 # Advertise functions we declared for the user - there are more, but these are the common ones
 # ****************************************************************************
-courseAdvertisements["untilStreamIsReady"] = ("f", "name, progressions=3", """
+courseAdvertisements["untilStreamIsReady"] = ("f", "name, progressions=3, timeout=None", """
   <div>Introduced in the course <b>Structured Streaming</b>, this method blocks until the stream is actually ready for processing.</div>
-  <div>By default, it waits for 3 progressions of the stream to ensure sufficent data has been processed.</div>""")
+  <div>By default, it waits for 3 progressions of the stream to ensure sufficent data has been processed.</div>
+  <div>It wakes on stream progress events rather than polling, and raises a <code>TimeoutError</code> if a <code>timeout</code> (in seconds) expires first.</div>""")
 courseAdvertisements["stopAllStreams"] = ("f", "", """
   <div>Introduced in the course <b>Structured Streaming</b>, this method stops all active streams while providing extra exception handling.</div>
   <div>It is functionally equivilent to:<div>
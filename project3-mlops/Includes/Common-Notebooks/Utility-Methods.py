@@ -99,13 +99,38 @@
 # MAGIC # Utility method to wait until the stream is read
 # MAGIC # ****************************************************************************
 # MAGIC 
-# MAGIC def untilStreamIsReady(name, progressions=3):
-# MAGIC   import time
-# MAGIC   queries = list(filter(lambda query: query.name == name, getActiveStreams()))
-# MAGIC 
-# MAGIC   while (len(queries) == 0 or len(queries[0].recentProgress) < progressions):
-# MAGIC     time.sleep(5) # Give it a couple of seconds
-# MAGIC     queries = list(filter(lambda query: query.name == name, getActiveStreams()))
+# MAGIC def untilStreamIsReady(name, progressions=3, timeout=None):
+# MAGIC   import threading, time
+# MAGIC   from pyspark.sql.streaming import StreamingQueryListener
+# MAGIC 
+# MAGIC   class ProgressListener(StreamingQueryListener):
+# MAGIC     # Wakes the waiting loop on every stream event instead of sleeping
+# MAGIC     def __init__(self):
+# MAGIC       self.changed = threading.Event()
+# MAGIC     def onQueryStarted(self, event):
+# MAGIC       self.changed.set()
+# MAGIC     def onQueryProgress(self, event):
+# MAGIC       self.changed.set()
+# MAGIC     def onQueryIdle(self, event):
+# MAGIC       pass
+# MAGIC     def onQueryTerminated(self, event):
+# MAGIC       self.changed.set()
+# MAGIC 
+# MAGIC   listener = ProgressListener()
+# MAGIC   spark.streams.addListener(listener)
+# MAGIC   deadline = None if timeout is None else time.time() + timeout
+# MAGIC   try:
+# MAGIC     while True:
+# MAGIC       listener.changed.clear()
+# MAGIC       queries = list(filter(lambda query: query.name == name, getActiveStreams()))
+# MAGIC       if len(queries) > 0 and len(queries[0].recentProgress) >= progressions:
+# MAGIC         break
+# MAGIC       remaining = None if deadline is None else deadline - time.time()
+# MAGIC       if remaining is not None and remaining <= 0:
+# MAGIC         raise TimeoutError("The stream {} was not ready after {} seconds.".format(name, timeout))
+# MAGIC       listener.changed.wait(remaining)
+# MAGIC   finally:
+# MAGIC     spark.streams.removeListener(listener)
 # MAGIC 
 # MAGIC   print("The stream {} is active and ready.".format(name))
 # MAGIC 